@@ -0,0 +1,54 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""Compiled JPEG marker walk for read_imu.py.
+
+Optional: read_imu falls back to the pure-Python _scan_app1_py when this
+extension is not built. Build in place with: cythonize -3 -i _read_imu_core.pyx
+"""
+
+cdef enum:
+    _FOUND = 0
+    _NEED_MORE = 1
+    _NO_EXIF = 2
+    _BAD_MARKER = 3
+
+cdef inline int _walk_markers(const unsigned char[:] buf, Py_ssize_t *start, Py_ssize_t *end) noexcept nogil:
+    cdef Py_ssize_t n = buf.shape[0]
+    cdef Py_ssize_t pos = 2 # Past SOI
+    cdef unsigned char marker
+    cdef Py_ssize_t length
+    while True:
+        if pos + 4 > n:
+            end[0] = pos + 4
+            return _NEED_MORE
+        if buf[pos] != 0xff:
+            return _BAD_MARKER
+        marker = buf[pos + 1]
+        if marker == 0xff: # Fill byte before a marker
+            pos += 1
+            continue
+        if marker == 0xda or marker == 0xd9: # SOS/EOI: no more metadata segments
+            return _NO_EXIF
+        length = (<Py_ssize_t>buf[pos + 2] << 8) | buf[pos + 3]
+        if marker == 0xe1:
+            if pos + 10 > n:
+                end[0] = pos + 10
+                return _NEED_MORE
+            if (buf[pos + 4] == b'E' and buf[pos + 5] == b'x' and buf[pos + 6] == b'i'
+                    and buf[pos + 7] == b'f' and buf[pos + 8] == 0 and buf[pos + 9] == 0):
+                start[0] = pos + 10
+                end[0] = pos + 2 + length
+                return _FOUND
+        pos += 2 + length
+
+def scan_app1(const unsigned char[:] data):
+    """Same contract as read_imu._scan_app1_py: (tiff_start, segment_end), None, or (-1, bytes_needed)."""
+    cdef Py_ssize_t start = -1
+    cdef Py_ssize_t end = 0
+    cdef int status
+    with nogil:
+        status = _walk_markers(data, &start, &end)
+    if status == _NO_EXIF:
+        return None
+    if status == _BAD_MARKER:
+        raise ValueError("Invalid JPEG marker")
+    return start, end
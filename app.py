@@ -1,21 +1,80 @@
+import atexit
+import collections
+import errno
 import flask
+import flask.json.provider
 import json
+import logging
 import os
+import queue
+import struct
 import subprocess
-import datetime
 import time
+import urllib.parse
 import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import paho.mqtt.client as paho_mqtt # Added
 import piexif # Added
 import piexif.helper # Added
+import numpy as np
+import orjson
+import werkzeug.security
+import v4l2_capture
+
+class OrjsonProvider(flask.json.provider.JSONProvider):
+    """Flask JSON provider backed by orjson, so flask.jsonify uses the C encoder."""
+    # Match the default provider's sorted keys
+    _dumps_option = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        # Map the json.dumps arguments orjson has an equivalent for; refuse the rest
+        # rather than silently ignoring them
+        option = self._dumps_option
+        default = kwargs.pop('default', None)
+        if kwargs.pop('indent', None):
+            option |= orjson.OPT_INDENT_2 # orjson only supports two-space indentation
+        if not kwargs.pop('sort_keys', True):
+            option &= ~orjson.OPT_SORT_KEYS
+        if kwargs:
+            raise TypeError(f"Unsupported arguments for orjson dumps: {', '.join(kwargs)}")
+        return orjson.dumps(obj, default=default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            raise TypeError(f"Unsupported arguments for orjson loads: {', '.join(kwargs)}")
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=self._dumps_option), mimetype="application/json")
 
 app = flask.Flask(__name__)
+app.json = OrjsonProvider(app)
 
 CONFIG_FILE = 'config.json'
 SNAPSHOT_DIR = 'snapshots'
 # Ensure snapshot directory exists
 os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+SNAPSHOT_DIR_PREFIX = SNAPSHOT_DIR + os.sep
+# Absolute path used when serving snapshots (resolved once, against the same cwd they are written to)
+SNAPSHOT_DIR_PATH = os.path.abspath(SNAPSHOT_DIR)
+# Snapshots never change once written, so browsers may cache them
+SNAPSHOT_MAX_AGE = 3600
+# Let a fronting nginx/apache send snapshot files itself (X-Sendfile)
+if os.environ.get('X_SENDFILE') == '1':
+    app.config['USE_X_SENDFILE'] = True
+
+# Worker threads for the waitress WSGI server (see __main__)
+WSGI_THREADS = 8
+# Shared worker pool for multi-camera captures, so a request does not spawn its own threads
+_CAPTURE_POOL = ThreadPoolExecutor(max_workers=max(4, os.cpu_count() or 2), thread_name_prefix='cap')
+# Stereo pairs get their own pool: queued /snapshot/all captures must never delay one camera
+# of a pair behind the other. Sized for two pairs in flight at once.
+_STEREO_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix='stereo')
+# atexit runs handlers last-in first-out: drain the pools, then close the devices held open for in-process capture
+atexit.register(v4l2_capture.release_all)
+atexit.register(_CAPTURE_POOL.shutdown)
+atexit.register(_STEREO_POOL.shutdown)
 
 # --- MQTT Configuration and Globals ---
 MQTT_BROKER_HOST = "127.0.0.1"
@@ -23,13 +82,13 @@ MQTT_BROKER_PORT = 1883
 MQTT_TOPIC = "status/"
 mqtt_client = None
 
-latest_imu_data = {
-    "roll": None,
-    "pitch": None,
-    "yaw": None,
-    "timestamp": None
-}
-imu_data_lock = threading.Lock()
+# The latest IMU reading is an immutable tuple replaced wholesale by on_message.
+# Rebinding a module global is atomic under the GIL, so readers never see a
+# half-updated sample and neither side needs a lock.
+ImuSample = collections.namedtuple('ImuSample', ['roll', 'pitch', 'yaw', 'timestamp'])
+_latest_imu = ImuSample(None, None, None, None)
+_mqtt_queue = queue.SimpleQueue()
+_mqtt_consumer_thread = None
 
 def on_connect(client, userdata, flags, rc):
     """MQTT connect callback."""
@@ -41,31 +100,49 @@ def on_connect(client, userdata, flags, rc):
         app.logger.error(f"Failed to connect to MQTT Broker, return code {rc}")
 
 def on_message(client, userdata, msg):
-    """MQTT message callback to process IMU data."""
-    global latest_imu_data, imu_data_lock
+    """MQTT message callback. Only enqueues the raw payload so paho's network
+    thread never blocks; _mqtt_consumer_loop does the decoding."""
+    _mqtt_queue.put_nowait(msg.payload)
+
+def _process_imu_payload(raw_payload):
+    """Decodes one MQTT payload and publishes it if it carries IMU data.
+    Returns True if _latest_imu was updated."""
+    global _latest_imu
     try:
-        payload = json.loads(msg.payload.decode())
-        # app.logger.debug(f"Received MQTT message on {msg.topic}: {payload}")
+        payload = orjson.loads(raw_payload) # orjson parses the bytes payload directly
+        # app.logger.debug(f"Received MQTT message: {payload}")
         if "roll" in payload and "pitch" in payload and "yaw" in payload:
-            with imu_data_lock:
-                latest_imu_data["roll"] = payload["roll"]
-                latest_imu_data["pitch"] = payload["pitch"]
-                latest_imu_data["yaw"] = payload["yaw"]
-                latest_imu_data["timestamp"] = time.time() # Record when data was processed
-            # app.logger.debug(f"Updated IMU data: {latest_imu_data}")
-    except json.JSONDecodeError:
-        app.logger.error(f"Failed to decode JSON from MQTT message: {msg.payload}")
+            # timestamp records when data was processed
+            _latest_imu = ImuSample(payload["roll"], payload["pitch"], payload["yaw"], time.time())
+            # app.logger.debug(f"Updated IMU data: {_latest_imu}")
+            return True
+    except orjson.JSONDecodeError:
+        app.logger.error(f"Failed to decode JSON from MQTT message: {raw_payload}")
     except Exception as e:
         app.logger.error(f"Error processing MQTT message: {e}")
+    return False
+
+def _mqtt_consumer_loop():
+    """Consumes queued MQTT payloads. Bursts are coalesced: only the newest
+    payload carrying IMU data matters, since we only ever expose the latest."""
+    while True:
+        pending = [_mqtt_queue.get()]
+        while not _mqtt_queue.empty():
+            pending.append(_mqtt_queue.get_nowait())
+        for raw_payload in reversed(pending):
+            if _process_imu_payload(raw_payload):
+                break
 
 def get_current_imu_data():
-    """Safely get a copy of the latest IMU data."""
-    with imu_data_lock:
-        return latest_imu_data.copy()
+    """Get the latest IMU data as an ImuSample (immutable, safe to share)."""
+    return _latest_imu
 
 def init_mqtt_client():
     """Initializes and starts the MQTT client."""
-    global mqtt_client
+    global mqtt_client, _mqtt_consumer_thread
+    if _mqtt_consumer_thread is None:
+        _mqtt_consumer_thread = threading.Thread(target=_mqtt_consumer_loop, name="mqtt-imu-consumer", daemon=True)
+        _mqtt_consumer_thread.start()
     try:
         # Using a unique client_id can be helpful if multiple instances run
         client_id = f"snapshot_server_imu_{os.getpid()}"
@@ -81,56 +158,117 @@ def init_mqtt_client():
         app.logger.error(f"Failed to initialize MQTT client: {e}")
 
 # --- EXIF Metadata Helper ---
-def _embed_imu_metadata_in_image(filepath, imu_data_to_embed, camera_config):
-    """Embeds IMU data as JSON into the image's EXIF UserComment tag, applying camera-specific offsets.
-    Returns True on success, False on failure.
-    """
-    if not os.path.exists(filepath):
-        app.logger.error(f"File not found for metadata embedding: {filepath}")
-        return False
+# EXIF "UNICODE" character code header; piexif.helper.UserComment encodes the body as UTF-16BE
+_USER_COMMENT_UNICODE_PREFIX = b'UNICODE\x00'
 
-    # Apply offsets
-    adjusted_imu_data = imu_data_to_embed.copy()
-    roll_offset = float(camera_config.get('roll_offset', 0.0))
-    pitch_offset = float(camera_config.get('pitch_offset', 0.0))
-    yaw_offset = float(camera_config.get('yaw_offset', 0.0))
+def _user_comment_payload(text):
+    """Equivalent to piexif.helper.UserComment.dump(text, encoding='unicode') with the header prebuilt."""
+    return _USER_COMMENT_UNICODE_PREFIX + text.encode('utf_16_be', errors='replace')
 
-    if adjusted_imu_data.get("roll") is not None:
-        try:
-            adjusted_imu_data["roll"] = float(adjusted_imu_data["roll"]) + roll_offset
-        except (ValueError, TypeError):
-            app.logger.warning(f"Could not apply roll offset for {camera_config['name']}, invalid roll data: {adjusted_imu_data.get('roll')}")
-    if adjusted_imu_data.get("pitch") is not None:
+# Reading every snapshot back to verify the UserComment doubles the EXIF I/O, so it
+# only runs when debug logging is on or SNAPSHOT_VERIFY_EXIF is set.
+VERIFY_EXIF = bool(os.environ.get('SNAPSHOT_VERIFY_EXIF'))
+
+def _exif_verification_enabled():
+    return VERIFY_EXIF or app.logger.isEnabledFor(logging.DEBUG)
+
+IMU_AXES = ('roll', 'pitch', 'yaw')
+
+def _camera_offsets(camera_config):
+    """Returns the camera's (roll, pitch, yaw) offsets as an array, as precomputed by
+    load_config under '_offsets' (parsed here for configs that did not come from it)."""
+    offsets = camera_config.get('_offsets')
+    if offsets is None:
+        offsets = np.array([float(camera_config.get(f'{axis}_offset', 0.0)) for axis in IMU_AXES], dtype=np.float64)
+    return offsets
+
+def _imu_axes_array(imu_sample, camera_config):
+    """Converts the sample's roll/pitch/yaw to a float array, with NaN for missing values."""
+    values = [np.nan if value is None else value for value in imu_sample[:3]]
+    try:
+        return np.array(values, dtype=np.float64)
+    except (ValueError, TypeError):
+        pass
+    # Rare path: find out which axis is invalid
+    axes = np.full(3, np.nan)
+    for i, (axis, value) in enumerate(zip(IMU_AXES, values)):
         try:
-            adjusted_imu_data["pitch"] = float(adjusted_imu_data["pitch"]) + pitch_offset
+            axes[i] = float(value)
         except (ValueError, TypeError):
-            app.logger.warning(f"Could not apply pitch offset for {camera_config['name']}, invalid pitch data: {adjusted_imu_data.get('pitch')}")
-    if adjusted_imu_data.get("yaw") is not None:
+            app.logger.warning(f"Could not apply {axis} offset for {camera_config['name']}, invalid {axis} data: {value}")
+    return axes
+
+_JPEG_SOI = b'\xff\xd8'
+_EXIF_HEADER = b'Exif\x00\x00'
+
+def _atomic_write_file(filepath, *chunks):
+    """Writes chunks to a temporary file in one pass and atomically swaps it in as filepath.
+    The data is fsynced before the rename, so a power loss leaves either the old file or
+    the complete new one, never a truncated JPEG."""
+    tmp_filepath = f"{filepath}.tmp"
+    try:
+        with open(tmp_filepath, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filepath, filepath)
+    except OSError:
         try:
-            adjusted_imu_data["yaw"] = float(adjusted_imu_data["yaw"]) + yaw_offset
-        except (ValueError, TypeError):
-            app.logger.warning(f"Could not apply yaw offset for {camera_config['name']}, invalid yaw data: {adjusted_imu_data.get('yaw')}")
-    
-    # Format to string with fixed precision after offset application if desired, or keep as float
-    # For simplicity, keeping as float for JSON dump. Could format here:
-    # adjusted_imu_data["roll"] = f"{adjusted_imu_data['roll']:.3f}" if adjusted_imu_data["roll"] is not None else None
-    # etc.
+            os.unlink(tmp_filepath)
+        except OSError:
+            pass
+        raise
 
+def _split_jpeg_header(frame):
+    """Skips the leading APP0 (JFIF) and Exif APP1 segments the camera emitted after SOI.
+    Returns (existing Exif APP1 payload or None, offset where the kept image data starts).
+    """
+    pos = len(_JPEG_SOI)
+    existing_exif = None
+    while frame[pos:pos + 2] in (b'\xff\xe0', b'\xff\xe1'):
+        length = struct.unpack('>H', frame[pos + 2:pos + 4])[0]
+        if frame[pos + 1] == 0xe1:
+            if frame[pos + 4:pos + 10] != _EXIF_HEADER:
+                break # Other APP1 payloads (e.g. XMP) are kept as-is
+            existing_exif = frame[pos + 4:pos + 2 + length]
+        pos += 2 + length
+    return existing_exif, pos
+
+def _write_image_with_imu_metadata(filepath, frame, imu_data_to_embed, camera_config):
+    """Writes a captured JPEG frame to filepath with IMU data embedded as JSON in the EXIF
+    UserComment tag, applying camera-specific offsets. The EXIF APP1 segment is spliced in
+    while writing, so the image is never re-read or re-parsed.
+    Returns True on success, False on failure (the raw frame is still written if possible).
+    """
+    # Apply offsets as one vector add; missing or invalid axes become NaN and are masked out
+    adjusted = _imu_axes_array(imu_data_to_embed, camera_config) + _camera_offsets(camera_config)
+    valid = np.isfinite(adjusted)
+
+    # Format to string with fixed precision after offset application if desired, or keep as float
+    # For simplicity, keeping as float for JSON dump.
     relevant_imu_data = {
-        k: adjusted_imu_data[k] for k in ["roll", "pitch", "yaw", "timestamp"]
-        if k in adjusted_imu_data and adjusted_imu_data[k] is not None
+        axis: value for axis, value, ok in zip(IMU_AXES, adjusted.tolist(), valid.tolist()) if ok
     }
+    if imu_data_to_embed.timestamp is not None:
+        relevant_imu_data["timestamp"] = imu_data_to_embed.timestamp
 
-    if not relevant_imu_data or not any(k in relevant_imu_data for k in ["roll", "pitch", "yaw"]):
+    if not valid.any():
         app.logger.info(f"No relevant IMU data (roll, pitch, yaw) after adjustments to embed for {filepath}")
-        return True # No data to embed is not an error in embedding itself.
+        return _write_raw_frame(filepath, frame) # No data to embed is not an error in embedding itself.
 
     try:
-        imu_json_string = json.dumps(relevant_imu_data)
-        user_comment_payload = piexif.helper.UserComment.dump(imu_json_string, encoding='unicode')
+        imu_json_string = orjson.dumps(relevant_imu_data).decode()
+        user_comment_payload = _user_comment_payload(imu_json_string)
+
+        if frame[:2] != _JPEG_SOI:
+            raise piexif.InvalidImageDataError("Captured frame is not a JPEG")
+        existing_exif, image_data_start = _split_jpeg_header(frame)
 
         try:
-            exif_dict = piexif.load(filepath)
+            if existing_exif is None:
+                raise piexif.InvalidImageDataError("No Exif APP1 segment in frame")
+            exif_dict = piexif.load(existing_exif)
             # Ensure all standard IFD dictionaries exist if piexif.load provided a partial structure
             for ifd_name in ["0th", "Exif", "GPS", "Interop", "1st"]:
                 if ifd_name not in exif_dict or not isinstance(exif_dict[ifd_name], dict):
@@ -152,10 +290,22 @@ def _embed_imu_metadata_in_image(filepath, imu_data_to_embed, camera_config):
         exif_dict["0th"][piexif.ImageIFD.Software] = "SnapshotServer/PiexifV1"
         
         exif_bytes = piexif.dump(exif_dict)
-        piexif.insert(exif_bytes, filepath)
-        app.logger.info(f"Attempted to embed IMU data into {filepath}. UserComment: {imu_json_string}")
-
-        # ---- Verification Step ----
+        # The APP1 length field is 16 bits and counts itself; a bigger block (e.g. a large
+        # thumbnail carried over from the camera) cannot be spliced in as one segment
+        if not exif_bytes.startswith(_EXIF_HEADER) or len(exif_bytes) + 2 > 0xffff:
+            app.logger.error(f"EXIF block for {filepath} does not fit in an APP1 segment ({len(exif_bytes)} bytes)")
+            _write_raw_frame(filepath, frame)
+            return False
+        app1_segment = b'\xff\xe1' + struct.pack('>H', len(exif_bytes) + 2) + exif_bytes
+
+        # SOI + our APP1 + the frame minus its SOI/APP0/Exif APP1, in one file write
+        _atomic_write_file(filepath, _JPEG_SOI, app1_segment, memoryview(frame)[image_data_start:])
+        app.logger.info(f"Embedded IMU data into {filepath}. UserComment: {imu_json_string}")
+
+        if not _exif_verification_enabled():
+            return True
+
+        # ---- Verification Step (debug only) ----
         try:
             verify_exif_dict = piexif.load(filepath)
             retrieved_user_comment_bytes = verify_exif_dict.get("Exif", {}).get(piexif.ExifIFD.UserComment)
@@ -181,47 +331,113 @@ def _embed_imu_metadata_in_image(filepath, imu_data_to_embed, camera_config):
             return False # If verification itself fails, consider embedding failed
         # ---- End Verification Step ----
 
-    except FileNotFoundError: # Should be caught by initial check, but good practice
-        app.logger.error(f"File disappeared before metadata embedding: {filepath}")
-        return False
     except Exception as e:
         app.logger.error(f"Failed to embed IMU metadata into {filepath}: {e}")
+        _write_raw_frame(filepath, frame) # Keep the image for debugging
+        return False
+
+def _write_raw_frame(filepath, frame):
+    try:
+        _atomic_write_file(filepath, frame)
+        return True
+    except OSError as e:
+        app.logger.error(f"Failed to write image file {filepath}: {e}")
         return False
 
 
 # --- Configuration Helpers ---
-def load_config():
-    if not os.path.exists(CONFIG_FILE):
-        return []
+# Parsed config.json, reused until the file's mtime changes
+_config_cache = {'mtime': None, 'data': [], 'by_name': {}}
+_config_lock = threading.Lock()
+# Keys _prepare_camera_config adds at runtime; never saved or returned by the API
+_DERIVED_KEYS = ('_offsets', '_capture_cmd')
+
+def _prepare_camera_config(cam):
+    """Precomputes the per-camera values the snapshot paths use on every capture.
+    Stored under _DERIVED_KEYS, which public_camera_config strips again."""
+    cam['_offsets'] = _camera_offsets(cam)
+    cam['_capture_cmd'] = [
+        'v4l2-ctl', '-d', cam['device_path'],
+        f"--set-fmt-video=width={cam['width']},height={cam['height']},pixelformat={cam['pixel_format']}",
+        '--stream-mmap', '--stream-count=1', '--stream-to=-'
+    ]
+    return cam
+
+def _refresh_config_cache():
+    """Reloads config.json into _config_cache if it changed. Caller holds _config_lock."""
     try:
-        with open(CONFIG_FILE, 'r') as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        return []
+        mtime = os.stat(CONFIG_FILE).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+        data = []
+    else:
+        if mtime == _config_cache['mtime'] and _config_cache['data'] is not None:
+            return
+        try:
+            with open(CONFIG_FILE, 'r') as f:
+                data = json.load(f)
+        except json.JSONDecodeError:
+            data = []
+    _config_cache['mtime'] = mtime
+    for cam in data:
+        try:
+            _prepare_camera_config(cam)
+        except (KeyError, ValueError, TypeError) as e:
+            app.logger.error(f"Invalid camera entry in {CONFIG_FILE} ({cam.get('name')}): {e}")
+    _config_cache['data'] = data
+    _config_cache['by_name'] = {cam['name']: cam for cam in data}
+    # Close devices held open for cameras that were deleted, moved or switched to stream_interrupt,
+    # so v4l2-ctl or the restarted service does not find them busy
+    in_process_devices = set()
+    for cam in data:
+        try:
+            if _uses_in_process_capture(cam):
+                in_process_devices.add(cam['device_path'])
+        except KeyError:
+            pass
+    v4l2_capture.release_unused(in_process_devices)
+
+def load_config():
+    with _config_lock:
+        _refresh_config_cache()
+        return list(_config_cache['data']) # Callers may append/filter without touching the cache
+
+def public_camera_config(camera_config):
+    """Camera config without the derived keys cached at runtime (user keys are kept as-is)."""
+    return {k: v for k, v in camera_config.items() if k not in _DERIVED_KEYS}
 
 def save_config(config):
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config, f, indent=2)
+    with _config_lock:
+        config_json = json.dumps([public_camera_config(cam) for cam in config], indent=2)
+        _atomic_write_file(CONFIG_FILE, config_json.encode('utf-8'))
+        _config_cache['data'] = None # Force a reload, which also releases captures no longer in use
+        _refresh_config_cache()
 
 def get_camera_config(camera_name):
-    config = load_config()
-    for cam in config:
-        if cam['name'] == camera_name:
-            return cam
-    return None
+    with _config_lock:
+        _refresh_config_cache()
+        return _config_cache['by_name'].get(camera_name)
 
 # --- Command Execution Helper ---
-def _run_command(command_list, timeout=15):
-    """Runs a shell command and returns (success, output_or_error_message)."""
+def _run_command(command_list, timeout=15, binary_output=False):
+    """Runs a shell command and returns (success, output_or_error_message).
+    Output is captured as bytes and only decoded where it is actually used;
+    with binary_output=True the raw stdout bytes are returned on success.
+    """
     app.logger.info(f"Running command: {' '.join(command_list)}")
     try:
-        process = subprocess.run(command_list, capture_output=True, text=True, timeout=timeout, check=False)
+        process = subprocess.run(command_list, capture_output=True, timeout=timeout, check=False)
         if process.returncode == 0:
-            app.logger.info(f"Command successful: {' '.join(command_list)}. Output: {process.stdout.strip()}")
-            return True, process.stdout.strip()
+            if binary_output:
+                app.logger.info(f"Command successful: {' '.join(command_list)}. Output: {len(process.stdout)} bytes")
+                return True, process.stdout
+            output = process.stdout.decode('utf-8', 'replace').strip()
+            app.logger.info(f"Command successful: {' '.join(command_list)}. Output: {output}")
+            return True, output
         else:
-            app.logger.error(f"Command failed: {' '.join(command_list)}\nStderr: {process.stderr.strip()} (Code: {process.returncode})")
-            return False, f"Error: {process.stderr.strip()} (Code: {process.returncode})"
+            stderr = process.stderr.decode('utf-8', 'replace').strip()
+            app.logger.error(f"Command failed: {' '.join(command_list)}\nStderr: {stderr} (Code: {process.returncode})")
+            return False, f"Error: {stderr} (Code: {process.returncode})"
     except subprocess.TimeoutExpired:
         app.logger.error(f"Command timed out: {' '.join(command_list)}")
         return False, "Error: Command timed out"
@@ -235,88 +451,183 @@ def _run_command(command_list, timeout=15):
 # --- Device Busy Check ---
 def is_device_busy(device_path, logger):
     """Checks if a V4L2 device is busy."""
-    # This command lists controls. If it fails with "Device or resource busy", it's busy.
-    # Other errors might mean different issues (e.g., device not found).
-    command = ['v4l2-ctl', '-d', device_path, '--list-controls']
-    logger.info(f"Checking if device {device_path} is busy with command: {' '.join(command)}")
+    # Open the node directly instead of spawning v4l2-ctl: the open fails with
+    # EBUSY if the driver only allows one user. Since most drivers allow several
+    # opens, also ask for zero buffers, which fails with EBUSY while another
+    # file handle owns the streaming buffers.
+    logger.info(f"Checking if device {device_path} is busy")
     try:
-        proc = subprocess.run(
-            command,
-            capture_output=True, text=True, timeout=3, check=False
-        )
-        # Typical exit code for busy can be 1 or 255, stderr contains "Device or resource busy"
-        if proc.returncode != 0:
-            stderr_lower = proc.stderr.lower()
-            if "busy" in stderr_lower or "eagain" in stderr_lower: # EAGAIN can also mean busy
-                logger.warning(f"Device {device_path} reported busy: {proc.stderr.strip()}")
-                return True
-            else:
-                # Other error, device might be unusable but not strictly "busy" by another app
-                logger.warning(f"v4l2-ctl check on {device_path} failed (code {proc.returncode}): {proc.stderr.strip()}")
-                return False # Or True if any error means we can't proceed
-        logger.info(f"Device {device_path} is not busy.")
-        return False # Command succeeded, device is responsive
-    except subprocess.TimeoutExpired:
-        logger.error(f"Timeout checking if device {device_path} is busy.")
-        return True # Assume busy or inaccessible if timeout
-    except FileNotFoundError:
-        logger.error(f"v4l2-ctl command not found for busy check. Please ensure v4l-utils is installed.")
-        return True # Cannot check, assume problematic
-    except Exception as e:
-        logger.error(f"Error checking if device {device_path} is busy: {e}")
-        return True # Unknown error, assume problematic
+        fd = os.open(device_path, os.O_RDWR | os.O_NONBLOCK)
+    except OSError as e:
+        if e.errno in (errno.EBUSY, errno.EAGAIN):
+            logger.warning(f"Device {device_path} reported busy: {e.strerror}")
+            return True
+        # Other error, device might be unusable but not strictly "busy" by another app
+        logger.warning(f"Opening {device_path} failed: {e}")
+        return False # Or True if any error means we can't proceed
+    try:
+        if v4l2_capture.buffers_owned_elsewhere(fd):
+            logger.warning(f"Device {device_path} reported busy: streaming buffers in use")
+            return True
+    except OSError as e:
+        logger.warning(f"Buffer check on {device_path} failed: {e}")
+    finally:
+        os.close(fd)
+    logger.info(f"Device {device_path} is not busy.")
+    return False
+
+# --- Service Interruption Helpers ---
+# stream_interrupt services are refcounted across concurrent and back-to-back
+# snapshots: a service is stopped by its first user and restarted only once it
+# has been idle for SERVICE_RESTART_DELAY seconds.
+# _service_lock only guards the bookkeeping below; the slow systemctl calls are
+# serialized per service with _service_op_locks, so snapshots from other
+# cameras never wait on them.
+SERVICE_RESTART_DELAY = 5.0
+_service_refs = {}
+_stopped_services = set()
+_service_restart_timers = {}
+_service_settle_deadlines = {} # service -> monotonic time its stop has settled
+_service_op_locks = collections.defaultdict(threading.Lock)
+_service_lock = threading.Lock()
+
+def _interrupt_services(cameras):
+    """Returns the unique service names that must be stopped to capture from cameras."""
+    service_names = []
+    for camera_config in cameras:
+        if camera_config['type'] == 'stream_interrupt':
+            service_name = camera_config.get('service_name')
+            if service_name and service_name not in service_names:
+                service_names.append(service_name)
+    return service_names
+
+def _service_op_lock(service_name):
+    with _service_lock:
+        return _service_op_locks[service_name]
+
+def _acquire_services(service_names, settle_time=1.0):
+    """Takes a reference on each service, stopping those still running.
+    Returns once every service's stop has settled for settle_time, including
+    stops issued by a concurrent snapshot."""
+    if not service_names:
+        return
+    with _service_lock:
+        for service_name in service_names:
+            _service_refs[service_name] = _service_refs.get(service_name, 0) + 1
+            timer = _service_restart_timers.pop(service_name, None)
+            if timer is not None:
+                timer.cancel()
+    for service_name in service_names:
+        with _service_op_lock(service_name):
+            with _service_lock:
+                running = service_name not in _stopped_services
+            if running:
+                app.logger.info(f"Stopping service {service_name}")
+                _run_command(['sudo', 'systemctl', 'stop', service_name])
+                with _service_lock:
+                    _stopped_services.add(service_name)
+                    _service_settle_deadlines[service_name] = time.monotonic() + settle_time
+    with _service_lock:
+        settle_deadline = max(_service_settle_deadlines.get(name, 0.0) for name in service_names)
+    remaining = settle_deadline - time.monotonic()
+    if remaining > 0:
+        time.sleep(remaining)  # Wait for services to stop
+
+def _release_services(service_names):
+    """Drops a reference on each service and schedules a restart for those left unused."""
+    if not service_names:
+        return
+    with _service_lock:
+        for service_name in service_names:
+            refs = _service_refs.get(service_name, 0) - 1
+            if refs > 0:
+                _service_refs[service_name] = refs
+                continue
+            _service_refs.pop(service_name, None)
+            timer = threading.Timer(SERVICE_RESTART_DELAY, _restart_service_if_idle, args=(service_name,))
+            timer.name = f"restart-{service_name}"
+            _service_restart_timers[service_name] = timer
+            timer.start()
+
+def _restart_service_if_idle(service_name):
+    with _service_op_lock(service_name):
+        with _service_lock:
+            # Skip if a newer snapshot took the service again, or a later timer superseded this one
+            if _service_refs.get(service_name, 0) > 0:
+                return
+            if _service_restart_timers.get(service_name) is not threading.current_thread():
+                return
+            del _service_restart_timers[service_name]
+            if service_name not in _stopped_services:
+                return
+        app.logger.info(f"Restarting service {service_name}")
+        _run_command(['sudo', 'systemctl', 'restart', service_name])
+        with _service_lock:
+            _stopped_services.discard(service_name)
+            _service_settle_deadlines.pop(service_name, None)
 
 # --- Snapshot Core Logic ---
-def capture_image(camera_config, base_filename_prefix="snapshot"):
-    """Captures an image from the specified camera and embeds IMU data."""
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S%f")
+def _snapshot_timestamp():
+    """Returns the current local time as YYYYmmdd_HHMMSSffffff, the same string as
+    datetime.now().strftime("%Y%m%d_%H%M%S%f") without building a datetime object."""
+    seconds, micros = divmod(time.time_ns() // 1000, 1_000_000)
+    return time.strftime("%Y%m%d_%H%M%S", time.localtime(seconds)) + "%06d" % micros
+
+def _uses_in_process_capture(camera_config):
+    """Plain v4l2 MJPEG cameras are kept open in-process. stream_interrupt cameras are
+    not, since holding the device would block their service once it is restarted.
+    """
+    return (camera_config['type'] == 'v4l2'
+            and camera_config['pixel_format'] in v4l2_capture.SUPPORTED_PIXEL_FORMATS)
+
+def _capture_frame(camera_config):
+    """Captures one frame into memory. Returns (success, frame_bytes_or_error_message)."""
+    if _uses_in_process_capture(camera_config):
+        capture = None
+        try:
+            capture = v4l2_capture.get_capture(
+                camera_config['device_path'], int(camera_config['width']),
+                int(camera_config['height']), camera_config['pixel_format'])
+            return True, capture.grab()
+        except (OSError, ValueError) as e:
+            # Drop the handle so the next snapshot reopens the device, and fall back to v4l2-ctl
+            if capture is not None:
+                v4l2_capture.release_capture(camera_config['device_path'], capture)
+            app.logger.warning(f"In-process capture failed for {camera_config['name']}: {e}. Falling back to v4l2-ctl.")
+
+    cmd_capture = camera_config.get('_capture_cmd') or _prepare_camera_config(dict(camera_config))['_capture_cmd']
+    return _run_command(cmd_capture, timeout=30, binary_output=True)
+
+def capture_image(camera_config, base_filename_prefix="snapshot", imu_data=None):
+    """Captures an image from the specified camera and embeds IMU data.
+
+    imu_data lets multi-camera callers share one IMU reading; if None the
+    latest reading is taken after capture.
+    """
+    timestamp = _snapshot_timestamp()
     filename = f"{base_filename_prefix}_{camera_config['name']}_{timestamp}.jpg"
-    filepath = os.path.join(SNAPSHOT_DIR, filename)
+    filepath = SNAPSHOT_DIR_PREFIX + filename # Trusted internal name, no os.path.join needed
 
     app.logger.info(f"Taking snapshot for {camera_config['name']}")
 
-    service_stopped = False
-    service_name = None
-    
-    if camera_config['type'] == 'stream_interrupt':
-        service_name = camera_config.get('service_name')
-        if service_name:
-            app.logger.info(f"Stopping service {service_name}")
-            _run_command(['sudo', 'systemctl', 'stop', service_name])
-            service_stopped = True
-            time.sleep(1)  # Wait for service to stop
-
-    # Simple v4l2-ctl capture
-    cmd_capture = [
-        'v4l2-ctl', '-d', camera_config['device_path'],
-        f"--set-fmt-video=width={camera_config['width']},height={camera_config['height']},pixelformat={camera_config['pixel_format']}",
-        '--stream-mmap', '--stream-count=1', f'--stream-to={filepath}'
-    ]
-
-    capture_ok, msg_capture = _run_command(cmd_capture, timeout=30)
-
-    # Restart service if needed
-    if service_stopped and service_name:
-        app.logger.info(f"Restarting service {service_name}")
-        _run_command(['sudo', 'systemctl', 'restart', service_name])
+    # A no-op if a multi-camera caller already holds the service
+    service_names = _interrupt_services([camera_config])
+    _acquire_services(service_names)
+    try:
+        capture_ok, frame_or_msg = _capture_frame(camera_config)
+    finally:
+        _release_services(service_names)
 
     if not capture_ok:
-        return False, f"Capture failed: {msg_capture}", None
+        return False, f"Capture failed: {frame_or_msg}", None
 
-    # Simple file check
-    if not os.path.exists(filepath) or os.path.getsize(filepath) < 1000:
-        # Clean up failed/small capture file before returning
-        if os.path.exists(filepath):
-            try:
-                os.remove(filepath)
-                app.logger.info(f"Removed incomplete/small file: {filepath}")
-            except OSError as e_rm:
-                app.logger.error(f"Error removing incomplete file {filepath}: {e_rm}")
-        return False, "Snapshot file not created or too small", None
+    # Simple size check, nothing is written for an empty/truncated frame
+    if len(frame_or_msg) < 1000:
+        return False, "Snapshot frame empty or too small", None
         
-    # Embed IMU data
-    current_imu = get_current_imu_data()
-    if not _embed_imu_metadata_in_image(filepath, current_imu, camera_config):
+    # Write the image with IMU data embedded
+    current_imu = imu_data if imu_data is not None else get_current_imu_data()
+    if not _write_image_with_imu_metadata(filepath, frame_or_msg, current_imu, camera_config):
         # Embedding failed. The image file exists but lacks metadata.
         # Report as failure to indicate the full operation wasn't successful.
         # The file is kept for potential debugging.
@@ -327,132 +638,132 @@ def capture_image(camera_config, base_filename_prefix="snapshot"):
     app.logger.info(f"Snapshot successful: {filename}")
     return True, filepath, filename
 
+def _capture_stereo_camera(camera_config, base_filename_prefix, timestamp, imu_data):
+    """Captures a single stereo camera and embeds IMU data. Runs in a worker thread,
+    so the returned result dict carries no URLs (url_for needs the request context).
+    """
+    filename = f"{base_filename_prefix}_{camera_config['name']}_{timestamp}.jpg"
+    filepath = SNAPSHOT_DIR_PREFIX + filename # Trusted internal name, no os.path.join needed
+
+    capture_start = time.time()
+    capture_ok, frame_or_msg = _capture_frame(camera_config)
+    capture_time = (time.time() - capture_start) * 1000
+    
+    if capture_ok and len(frame_or_msg) > 1000:
+        # Write the image with IMU data embedded
+        embedding_successful = _write_image_with_imu_metadata(filepath, frame_or_msg, imu_data, camera_config)
+
+        if embedding_successful:
+            app.logger.info(f"Stereo capture successful for {camera_config['name']}: {filename} ({len(frame_or_msg)} byte frame, {capture_time:.1f}ms)")
+            return {
+                "success": True,
+                "camera_name": camera_config['name'],
+                "filename": filename,
+                "capture_time_ms": capture_time
+            }
+        # Image captured, but metadata embedding failed.
+        error_msg = f"Image captured ({filename}), but failed to embed IMU metadata."
+        app.logger.error(f"Stereo capture for {camera_config['name']}: {error_msg}")
+        return {
+            "success": False,
+            "camera_name": camera_config['name'],
+            "error": error_msg,
+            "filename": filename # Include filename for reference
+        }
+
+    error_msg = f"Capture failed: {frame_or_msg}" if not capture_ok else "Frame empty or too small"
+    app.logger.error(f"Stereo capture failed for {camera_config['name']}: {error_msg}")
+    return {
+        "success": False,
+        "camera_name": camera_config['name'],
+        "error": error_msg
+    }
+
 def capture_stereo_simple(cameras, base_filename_prefix="stereo"):
-    """Capture from stereo cameras sequentially with minimal delay and embed IMU data."""
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S%f")
-    results = []
+    """Capture from stereo cameras in parallel for tight timing and embed IMU data."""
+    timestamp = _snapshot_timestamp()
     
-    app.logger.info(f"Starting sequential v4l2-ctl stereo capture for {len(cameras)} cameras")
+    app.logger.info(f"Starting parallel stereo capture for {len(cameras)} cameras")
     
     # Stop services if needed
-    services_to_restart = []
-    for camera_config in cameras:
-        if camera_config['type'] == 'stream_interrupt':
-            service_name = camera_config.get('service_name')
-            if service_name:
-                app.logger.info(f"Stopping service {service_name}")
-                _run_command(['sudo', 'systemctl', 'stop', service_name])
-                services_to_restart.append(service_name)
-    
-    if services_to_restart:
-        time.sleep(2)  # Wait for services to stop
+    service_names = _interrupt_services(cameras)
+    _acquire_services(service_names, settle_time=2)
     
-    # Capture sequentially with minimal delay
     start_time = time.time()
+    # One IMU reading for the whole pair, so all images share the same orientation sample
+    current_imu = get_current_imu_data()
+    results_by_name = {}
+    try:
+        futures = {
+            _STEREO_POOL.submit(_capture_stereo_camera, camera_config, base_filename_prefix, timestamp, current_imu): camera_config
+            for camera_config in cameras
+        }
+        for future in as_completed(futures):
+            camera_config = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                app.logger.error(f"Stereo capture raised for {camera_config['name']}: {e}")
+                result = {"success": False, "camera_name": camera_config['name'], "error": f"Exception: {e}"}
+            if result['success']:
+                result["image_url"] = _snapshot_url('serve_snapshot', result['filename'])
+                result["download_url"] = _snapshot_url('download_snapshot', result['filename'])
+            results_by_name[camera_config['name']] = result
+    finally:
+        total_time = (time.time() - start_time) * 1000
+        app.logger.info(f"Parallel stereo capture completed in {total_time:.1f}ms")
+        # Restart services (after the cool-down, unless another snapshot needs them)
+        _release_services(service_names)
     
-    for i, camera_config in enumerate(cameras):
-        filename = f"{base_filename_prefix}_{camera_config['name']}_{timestamp}.jpg"
-        filepath = os.path.join(SNAPSHOT_DIR, filename)
-        
-        app.logger.info(f"Sequential capture {i+1}/{len(cameras)}: {camera_config['name']}")
-        
-        cmd_capture = [
-            'v4l2-ctl', '-d', camera_config['device_path'],
-            f"--set-fmt-video=width={camera_config['width']},height={camera_config['height']},pixelformat={camera_config['pixel_format']}",
-            '--stream-mmap', '--stream-count=1', f'--stream-to={filepath}'
-        ]
-        
-        capture_start = time.time()
-        capture_ok, msg_capture = _run_command(cmd_capture, timeout=30)
-        capture_time = (time.time() - capture_start) * 1000
-        
-        if capture_ok and os.path.exists(filepath) and os.path.getsize(filepath) > 1000:
-            # Embed IMU data
-            current_imu = get_current_imu_data()
-            embedding_successful = _embed_imu_metadata_in_image(filepath, current_imu, camera_config)
+    # Keep results in configuration order regardless of completion order
+    results = [results_by_name[camera_config['name']] for camera_config in cameras]
 
-            if embedding_successful:
-                results.append({
-                    "success": True,
-                    "camera_name": camera_config['name'],
-                    "image_url": flask.url_for('serve_snapshot', filename=filename),
-                    "download_url": flask.url_for('download_snapshot', filename=filename),
-                    "filename": filename,
-                    "capture_time_ms": capture_time
-                })
-                file_size = os.path.getsize(filepath)
-                app.logger.info(f"Sequential capture successful for {camera_config['name']}: {filename} ({file_size} bytes, {capture_time:.1f}ms)")
-            else:
-                # Image captured, but metadata embedding failed.
-                error_msg = f"Image captured ({filename}), but failed to embed IMU metadata."
-                results.append({
-                    "success": False,
-                    "camera_name": camera_config['name'],
-                    "error": error_msg,
-                    "filename": filename # Include filename for reference
-                })
-                app.logger.error(f"Sequential capture for {camera_config['name']}: {error_msg}")
-        else:
-            error_msg = f"v4l2-ctl failed: {msg_capture}" if not capture_ok else "File not created or too small"
-            # Clean up failed/small capture file
-            if os.path.exists(filepath):
-                try:
-                    os.remove(filepath)
-                    app.logger.info(f"Removed problematic stereo capture file: {filepath}")
-                except OSError as e_rm:
-                    app.logger.error(f"Error removing problematic stereo file {filepath}: {e_rm}")
-            results.append({
-                "success": False,
-                "camera_name": camera_config['name'],
-                "error": error_msg
-            })
-            app.logger.error(f"Sequential capture failed for {camera_config['name']}: {error_msg}")
-        
-        # Very small delay between cameras for stereo
-        if i < len(cameras) - 1:
-            time.sleep(0.05)  # 50ms delay
-    
-    total_time = (time.time() - start_time) * 1000
-    app.logger.info(f"Sequential stereo capture completed in {total_time:.1f}ms")
-    
-    # Restart services
-    for service_name in services_to_restart:
-        app.logger.info(f"Restarting service {service_name}")
-        _run_command(['sudo', 'systemctl', 'restart', service_name])
-    
     # Summary
     successful_captures = [r for r in results if r['success']]
-    app.logger.info(f"Sequential stereo capture summary: {len(successful_captures)}/{len(cameras)} cameras successful")
+    app.logger.info(f"Stereo capture summary: {len(successful_captures)}/{len(cameras)} cameras successful")
     
     return results
 
 def _process_snapshot_requests(cameras_to_snapshot, base_filename_prefix="snapshot"):
-    """Process camera snapshots sequentially - simple and reliable."""
-    results = []
-    
-    app.logger.info(f"Taking sequential snapshots for {len(cameras_to_snapshot)} cameras")
-    
-    for cam_config in cameras_to_snapshot:
-        success, result_path_or_msg, filename = capture_image(cam_config, base_filename_prefix)
-        if success:
-            results.append({
-                "success": True,
-                "camera_name": cam_config['name'],
-                "image_url": flask.url_for('serve_snapshot', filename=filename),
-                "download_url": flask.url_for('download_snapshot', filename=filename),
-                "filename": filename
-            })
-        else:
-            results.append({
-                "success": False,
-                "camera_name": cam_config['name'],
-                "error": result_path_or_msg
-            })
-        
-        # Small delay between cameras
-        time.sleep(0.05)
-    
-    return results
+    """Process camera snapshots in parallel, holding services stopped for the whole batch."""
+    app.logger.info(f"Taking parallel snapshots for {len(cameras_to_snapshot)} cameras")
+
+    service_names = _interrupt_services(cameras_to_snapshot)
+    _acquire_services(service_names)
+
+    current_imu = get_current_imu_data() # Shared by every camera in the batch
+    results_by_name = {}
+    try:
+        futures = {
+            _CAPTURE_POOL.submit(capture_image, cam_config, base_filename_prefix, current_imu): cam_config
+            for cam_config in cameras_to_snapshot
+        }
+        for future in as_completed(futures):
+            cam_config = futures[future]
+            try:
+                success, result_path_or_msg, filename = future.result()
+            except Exception as e:
+                app.logger.error(f"Snapshot raised for {cam_config['name']}: {e}")
+                success, result_path_or_msg, filename = False, f"Exception: {e}", None
+            if success:
+                results_by_name[cam_config['name']] = {
+                    "success": True,
+                    "camera_name": cam_config['name'],
+                    "image_url": _snapshot_url('serve_snapshot', filename),
+                    "download_url": _snapshot_url('download_snapshot', filename),
+                    "filename": filename
+                }
+            else:
+                results_by_name[cam_config['name']] = {
+                    "success": False,
+                    "camera_name": cam_config['name'],
+                    "error": result_path_or_msg
+                }
+    finally:
+        _release_services(service_names)
+
+    # Keep results in configuration order regardless of completion order
+    return [results_by_name[cam_config['name']] for cam_config in cameras_to_snapshot]
 
 # --- Web UI Routes ---
 @app.route('/')
@@ -509,13 +820,40 @@ def delete_camera(camera_name):
     flask.flash(f"Camera '{camera_name}' deleted.", "success")
     return flask.redirect(flask.url_for('settings_page'))
 
+# URL prefixes of the snapshot routes, keyed by (endpoint, script root). Snapshot
+# filenames are generated internally, so a prefix + quoted name equals url_for's result.
+_snapshot_url_prefixes = {}
+_URL_PLACEHOLDER = '__filename__'
+# Characters Werkzeug's path converter leaves unescaped, so URLs match url_for byte for byte
+_URL_SAFE_CHARS = "!$&'()*+,/:;=@"
+
+def _snapshot_url(endpoint, filename):
+    """Builds the URL of a snapshot route without a url_for/routing lookup per image."""
+    key = (endpoint, flask.request.script_root)
+    prefix = _snapshot_url_prefixes.get(key)
+    if prefix is None:
+        prefix = flask.url_for(endpoint, filename=_URL_PLACEHOLDER)[:-len(_URL_PLACEHOLDER)]
+        _snapshot_url_prefixes[key] = prefix
+    return prefix + urllib.parse.quote(filename, safe=_URL_SAFE_CHARS)
+
+def _send_snapshot(filename, as_attachment=False):
+    """Sends a snapshot with Last-Modified/ETag and Range support, so repeated gallery
+    loads are answered with 304 and never re-read the file."""
+    filepath = werkzeug.security.safe_join(SNAPSHOT_DIR_PATH, filename)
+    if filepath is None:
+        flask.abort(404)
+    try:
+        return flask.send_file(filepath, as_attachment=as_attachment, conditional=True, max_age=SNAPSHOT_MAX_AGE)
+    except (FileNotFoundError, IsADirectoryError):
+        flask.abort(404)
+
 @app.route('/snapshots/<filename>')
 def serve_snapshot(filename):
-    return flask.send_from_directory(SNAPSHOT_DIR, filename)
+    return _send_snapshot(filename)
 
 @app.route('/download/<filename>')
 def download_snapshot(filename):
-    return flask.send_from_directory(SNAPSHOT_DIR, filename, as_attachment=True)
+    return _send_snapshot(filename, as_attachment=True)
 
 # --- UI Snapshot Triggers (POST requests from JS) ---
 @app.route('/ui/snapshot/<camera_name>', methods=['POST'])
@@ -528,8 +866,8 @@ def ui_snapshot_camera(camera_name):
     if success:
         return flask.jsonify({
             "success": True, 
-            "image_url": flask.url_for('serve_snapshot', filename=filename),
-            "download_url": flask.url_for('download_snapshot', filename=filename),
+            "image_url": _snapshot_url('serve_snapshot', filename),
+            "download_url": _snapshot_url('download_snapshot', filename),
             "filename": filename,
             "camera_name": camera_name
         })
@@ -561,7 +899,7 @@ def ui_snapshot_stereo():
 @app.route('/api/cameras', methods=['GET'])
 def api_get_cameras():
     config = load_config()
-    return flask.jsonify(config)
+    return flask.jsonify([public_camera_config(cam) for cam in config])
 
 @app.route('/api/snapshot/<camera_name>', methods=['GET', 'POST']) # Allow GET for simple API tests
 def api_snapshot_camera(camera_name):
@@ -576,7 +914,7 @@ def api_snapshot_camera(camera_name):
             "filename": filename,
             "message": f"Snapshot taken: {filename}",
             # For API, providing full URL might be useful if client is remote
-            "image_url_path": flask.url_for('serve_snapshot', filename=filename, _external=False) 
+            "image_url_path": _snapshot_url('serve_snapshot', filename)
         })
     else:
         return flask.jsonify({"success": False, "error": result}), 500
@@ -596,7 +934,7 @@ def api_snapshot_all():
                 "camera_name": res['camera_name'], 
                 "status": "success", 
                 "filename": res['filename'],
-                "image_url_path": flask.url_for('serve_snapshot', filename=res['filename'], _external=False)
+                "image_url_path": _snapshot_url('serve_snapshot', res['filename'])
             })
         else:
             api_results.append({
@@ -622,7 +960,7 @@ def api_snapshot_stereo():
                 "camera_name": res['camera_name'], 
                 "status": "success", 
                 "filename": res['filename'],
-                "image_url_path": flask.url_for('serve_snapshot', filename=res['filename'], _external=False)
+                "image_url_path": _snapshot_url('serve_snapshot', res['filename'])
             })
         else:
             api_results.append({
@@ -634,42 +972,32 @@ def api_snapshot_stereo():
 
 
 if __name__ == '__main__':
-    # Set process to be less aggressive
-    import os
-    import resource
-    
-    try:
-        # Lower process priority
-        os.nice(10)  # Higher nice value = lower priority
-        
-        # Limit CPU usage
-        resource.setrlimit(resource.RLIMIT_CPU, (30, 60))  # Limit CPU time
-        
-        # Set I/O priority to idle class (requires ionice)
+    # Optionally run the process less aggressively (LOW_PRIORITY=1). Off by default:
+    # a lower priority starves capture and EXIF work behind the very services we interrupt.
+    # (No RLIMIT_CPU either: it counts cumulative CPU time and would kill the server.)
+    if os.environ.get('LOW_PRIORITY') == '1':
         try:
-            subprocess.run(['ionice', '-c', '3', '-p', str(os.getpid())], check=False)
-        except:
-            pass
+            # Lower process priority
+            os.nice(10)  # Higher nice value = lower priority
             
-    except Exception as e:
-        print(f"Could not set process limits: {e}")
+            # Set I/O priority to idle class (requires ionice)
+            try:
+                subprocess.run(['ionice', '-c', '3', '-p', str(os.getpid())], check=False)
+            except:
+                pass
+                
+        except Exception as e:
+            print(f"Could not set process priority: {e}")
     
     app.secret_key = os.urandom(24)
+    if not _exif_verification_enabled():
+        app.logger.info("EXIF read-back verification is off (set SNAPSHOT_VERIFY_EXIF=1 to enable).")
+    # Start MQTT before the WSGI server so IMU data is flowing when requests arrive
     init_mqtt_client()
     
-    # Use Werkzeug with limited threads
-    from werkzeug.serving import make_server
-    
-    server = make_server(
-        host='0.0.0.0', 
-        port=88, 
-        app=app,
-        threaded=True,
-        processes=1  # Single process
-    )
-    
-    # Set thread limits
-    server.max_children = 2  # Limit concurrent requests
+    # Production WSGI server: a fixed worker-thread pool with a proper accept queue.
+    # Captures are I/O-bound (subprocess, V4L2, disk), so threads scale well here.
+    import waitress
     
-    print("Starting snapshot server with real-time optimizations...")
-    server.serve_forever()
+    print(f"Starting snapshot server on port 88 with {WSGI_THREADS} worker threads...")
+    waitress.serve(app, host='0.0.0.0', port=88, threads=WSGI_THREADS)
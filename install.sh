@@ -72,6 +72,19 @@ if [ $? -ne 0 ]; then
 fi
 echo "Python dependencies installed successfully."
 
+# --- Optional: compiled IMU reader ---
+if [ "$BUILD_CYTHON" = "1" ]; then
+    echo ""
+    echo "4b. Building the optional compiled IMU reader (_read_imu_core)..."
+    "$VENV_DIR/bin/pip" install "cython>=3.0" && \
+        (cd "$PROJECT_DIR" && "$VENV_DIR/bin/cythonize" -3 -i _read_imu_core.pyx)
+    if [ $? -ne 0 ]; then
+        echo "Warning: Failed to build _read_imu_core; read_imu.py will use the pure-Python reader."
+    else
+        echo "_read_imu_core built successfully."
+    fi
+fi
+
 # --- Install System Dependencies (v4l-utils and ffmpeg) ---
 echo ""
 echo "5. Installing system dependencies: v4l-utils and ffmpeg..."
@@ -1,11 +1,175 @@
+import concurrent.futures
+import copy
+import functools
+import os
 import piexif
 import piexif.helper
-import json
+import orjson
+import re
+import struct
 import sys
 
+_JPEG_SOI = b'\xff\xd8'
+_JPEG_MAGIC = _JPEG_SOI + b'\xff' # SOI followed by the first marker
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+_TIFF_MAGICS = (b'II*\x00', b'MM\x00*')
+_EXIF_HEADER = b'Exif\x00\x00'
+_EXIF_IFD_POINTER_TAG = 0x8769
+_USER_COMMENT_TAG = piexif.ExifIFD.UserComment
+_UC_PREFIX_SIZE = 8
+# Encodings whose payload orjson can parse straight from the EXIF bytes (ASCII and undefined)
+_UC_BYTES_PREFIXES = (b'ASCII\x00\x00\x00', b'\x00' * _UC_PREFIX_SIZE)
+_UC_UNICODE_PREFIX = b'UNICODE\x00'
+# 8-byte UserComment encoding prefix (NUL padded) + payload + trailing NUL padding, in one match
+_UC_RE = re.compile(r'^(?:UNICODE|ASCII|JIS)\x00*(.*?)\x00*$', re.DOTALL)
+# Bytes per TIFF field type, used to tell inline values from offsets (UNDEFINED/BYTE = 1)
+_TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8}
+
+def _load_user_comment_fast(user_comment_bytes):
+    """Decodes a UserComment to str, special-casing the UNICODE encoding the server writes.
+    EXIF "UNICODE" is UTF-16 big-endian (what piexif reads and writes); decoding it directly
+    skips piexif.helper's prefix dispatch. Other encodings go through piexif.helper.
+    """
+    if user_comment_bytes[:_UC_PREFIX_SIZE] == _UC_UNICODE_PREFIX:
+        return str(memoryview(user_comment_bytes)[_UC_PREFIX_SIZE:], 'utf_16_be', 'replace').rstrip('\x00')
+    return piexif.helper.UserComment.load(user_comment_bytes)
+
+def _find_ifd_entry(tiff, byte_order, ifd_offset, wanted_tag):
+    """Returns (type, count, value_offset) of a tag in the IFD at ifd_offset, or None."""
+    entry_count = struct.unpack_from(byte_order + 'H', tiff, ifd_offset)[0]
+    for entry in range(ifd_offset + 2, ifd_offset + 2 + 12 * entry_count, 12):
+        tag, field_type, count = struct.unpack_from(byte_order + 'HHI', tiff, entry)
+        if tag == wanted_tag:
+            if _TIFF_TYPE_SIZES.get(field_type, 1) * count <= 4:
+                return field_type, count, entry + 8 # Value stored inline
+            return field_type, count, struct.unpack_from(byte_order + 'I', tiff, entry + 8)[0]
+    return None
+
+def _user_comment_from_tiff(tiff):
+    """Walks IFD0 -> Exif IFD of a TIFF/EXIF block and returns the raw UserComment bytes, or None."""
+    if tiff[:2] == b'II':
+        byte_order = '<'
+    elif tiff[:2] == b'MM':
+        byte_order = '>'
+    else:
+        raise ValueError("Not a TIFF byte-order mark")
+    ifd0_offset = struct.unpack_from(byte_order + 'I', tiff, 4)[0]
+    exif_pointer = _find_ifd_entry(tiff, byte_order, ifd0_offset, _EXIF_IFD_POINTER_TAG)
+    if exif_pointer is None:
+        return None
+    exif_ifd_offset = struct.unpack_from(byte_order + 'I', tiff, exif_pointer[2])[0]
+    user_comment = _find_ifd_entry(tiff, byte_order, exif_ifd_offset, _USER_COMMENT_TAG)
+    if user_comment is None:
+        return None
+    _, count, value_offset = user_comment
+    value = tiff[value_offset:value_offset + count]
+    if len(value) != count:
+        raise struct.error("UserComment runs past the end of the EXIF data")
+    return bytes(value)
+
+# EXIF metadata sits at the start of the file; read this much up front and top up only if needed
+_HEADER_READ_SIZE = 65536
+
+def _read_more(f, data, end):
+    """Extends the file prefix in data so it covers at least end bytes (one extra read)."""
+    data += f.read(end - len(data))
+    if len(data) < end:
+        raise struct.error("Truncated image header")
+    return data
+
+def _scan_app1_py(data):
+    """Walks the JPEG markers in the file prefix data looking for the Exif APP1 segment.
+    Returns (tiff_start, segment_end) when found, None if SOS/EOI comes first, or
+    (-1, bytes_needed) if the prefix ends before the walk does. Raises ValueError on a
+    malformed marker.
+    """
+    pos = len(_JPEG_SOI)
+    data_len = len(data)
+    while True:
+        if pos + 4 > data_len:
+            return -1, pos + 4
+        if data[pos] != 0xff:
+            raise ValueError("Invalid JPEG marker")
+        marker = data[pos + 1]
+        if marker == 0xff: # Fill byte before a marker
+            pos += 1
+            continue
+        if marker in (0xda, 0xd9): # SOS/EOI: no more metadata segments
+            return None
+        length = (data[pos + 2] << 8) | data[pos + 3]
+        if marker == 0xe1:
+            if pos + 10 > data_len:
+                return -1, pos + 10
+            if data[pos + 4:pos + 10] == _EXIF_HEADER:
+                return pos + 10, pos + 2 + length
+        pos += 2 + length
+
+# Compiled marker walk (see README, "Optional compiled reader"); same contract as _scan_app1_py
+try:
+    from _read_imu_core import scan_app1 as _scan_app1
+except ImportError:
+    _scan_app1 = _scan_app1_py
+
+def _exif_tiff_from_jpeg(f, data):
+    """Returns the TIFF block of the Exif APP1 segment, scanning markers only up to SOS.
+    data is the prefix already read from f; it is extended only if a segment runs past it."""
+    while True:
+        bounds = _scan_app1(data)
+        if bounds is None:
+            return None
+        tiff_start, segment_end = bounds
+        if tiff_start >= 0:
+            break
+        data = _read_more(f, data, segment_end) # Marker walk ran past the prefix
+    if segment_end > len(data):
+        data = _read_more(f, data, segment_end)
+    return memoryview(data)[tiff_start:segment_end]
+
+def _exif_tiff_from_png(f):
+    """Returns the contents of the PNG eXIf chunk, or None if the image has none.
+    Only chunk headers are read; other chunks (e.g. IDAT) are seeked over."""
+    f.seek(len(_PNG_SIGNATURE))
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            raise struct.error("Truncated PNG chunk header")
+        length, chunk_type = struct.unpack('>I4s', header)
+        if chunk_type == b'eXIf':
+            chunk = f.read(length)
+            if len(chunk) < length:
+                raise struct.error("Truncated PNG eXIf chunk")
+            # Some writers keep the JPEG-style "Exif\0\0" prefix inside the chunk
+            return chunk[len(_EXIF_HEADER):] if chunk[:len(_EXIF_HEADER)] == _EXIF_HEADER else chunk
+        if chunk_type == b'IEND':
+            return None
+        f.seek(length + 4, os.SEEK_CUR) # Chunk data + CRC
+
+def _read_user_comment(image_path):
+    """Returns the raw EXIF UserComment bytes of a JPEG or PNG image, or None if it has none.
+    Only the file prefix holding the metadata is read, never the whole image. Raises
+    struct.error or ValueError for layouts it does not handle (TIFF/WebP or a damaged
+    header), so the caller can fall back to piexif.load, and piexif.InvalidImageDataError
+    straight away for files whose signature is no image format piexif reads either.
+    """
+    # Unbuffered: the prefix is one read() syscall and seeks do not discard a read-ahead buffer
+    with open(image_path, 'rb', buffering=0) as f:
+        data = f.read(_HEADER_READ_SIZE)
+        if data.startswith(_JPEG_MAGIC):
+            tiff = _exif_tiff_from_jpeg(f, data)
+        elif data.startswith(_PNG_SIGNATURE):
+            tiff = _exif_tiff_from_png(f)
+        elif data[:4] in _TIFF_MAGICS or (data[:4] == b'RIFF' and data[8:12] == b'WEBP'):
+            raise ValueError("TIFF/WebP image, left to piexif")
+        else:
+            raise piexif.InvalidImageDataError("Not a JPEG, PNG, TIFF or WebP image")
+    if tiff is None:
+        return None
+    return _user_comment_from_tiff(tiff)
+
 def read_imu_from_image(image_path):
     """
     Reads IMU data embedded in the EXIF UserComment tag of an image.
+    Results are cached per (path, size, mtime), so re-reading an unchanged image is free.
 
     Args:
         image_path (str): The path to the image file.
@@ -14,40 +178,63 @@ def read_imu_from_image(image_path):
         dict: A dictionary containing the IMU data, or None if not found or an error occurs.
     """
     try:
-        exif_dict = piexif.load(image_path)
-        user_comment_bytes = exif_dict.get("Exif", {}).get(piexif.ExifIFD.UserComment)
+        st = os.stat(image_path)
+    except FileNotFoundError:
+        print(f"Error: Image file not found at {image_path}")
+        return None
+    except OSError as e:
+        print(f"An unexpected error occurred: {e}")
+        return None
+    # Copy so callers cannot modify the cached result
+    return copy.copy(_read_imu_cached(image_path, st.st_size, st.st_mtime_ns))
+
+@functools.lru_cache(maxsize=4096)
+def _read_imu_cached(image_path, size, mtime_ns):
+    """Parses the IMU data of image_path. size and mtime_ns only key the cache: a
+    rewritten file gets a new entry instead of a stale result."""
+    try:
+        try:
+            user_comment_bytes = _read_user_comment(image_path)
+        except piexif.InvalidImageDataError:
+            raise # Not an image at all: skip the piexif.load fallback
+        except (struct.error, ValueError, IndexError):
+            # Layout the direct reader does not handle (e.g. TIFF/WebP or a damaged header)
+            exif_dict = piexif.load(image_path)
+            user_comment_bytes = exif_dict.get("Exif", {}).get(piexif.ExifIFD.UserComment)
 
         if user_comment_bytes:
-            # Decode the UserComment
-            # piexif.helper.UserComment.load handles the encoding (e.g., 'unicode', 'ascii')
-            try:
-                user_comment_str = piexif.helper.UserComment.load(user_comment_bytes)
-            except UnicodeDecodeError:
-                # Fallback for older piexif versions or different encodings if needed
-                # This assumes UTF-8 if 'unicode' fails, adjust if your server uses something else
+            if user_comment_bytes[:_UC_PREFIX_SIZE] in _UC_BYTES_PREFIXES:
+                # Parse the payload in place: no bytes -> str decode, orjson reads UTF-8 bytes directly
+                user_comment = memoryview(user_comment_bytes.rstrip(b'\x00'))[_UC_PREFIX_SIZE:]
+            else:
+                # Decode the UserComment (UNICODE directly, other encodings via piexif.helper)
                 try:
-                    user_comment_str = user_comment_bytes.decode('utf-8', errors='ignore')
-                    # Remove the encoding prefix if present (e.g., "UNICODE\x00\x00")
-                    if user_comment_str.startswith("UNICODE"):
-                        user_comment_str = user_comment_str.split('\x00\x00', 1)[-1].strip('\x00')
-                    elif user_comment_str.startswith("ASCII"):
-                         user_comment_str = user_comment_str.split('\x00\x00', 1)[-1].strip('\x00')
-
-                except Exception as e_decode_fallback:
-                    print(f"Error decoding UserComment with fallback: {e_decode_fallback}")
-                    return None
-
+                    user_comment = _load_user_comment_fast(user_comment_bytes)
+                except UnicodeDecodeError:
+                    # Fallback for older piexif versions or different encodings if needed
+                    # This assumes UTF-8 if 'unicode' fails, adjust if your server uses something else
+                    try:
+                        user_comment = user_comment_bytes.decode('utf-8', errors='ignore')
+                        # Remove the encoding prefix if present (e.g., "UNICODE\x00")
+                        match = _UC_RE.match(user_comment)
+                        if match:
+                            user_comment = match.group(1)
+                    except Exception as e_decode_fallback:
+                        print(f"Error decoding UserComment with fallback: {e_decode_fallback}")
+                        return None
 
             # The actual JSON string might be embedded within this comment string
-            # print(f"Raw UserComment string: '{user_comment_str}'") # For debugging
+            # print(f"Raw UserComment: '{user_comment}'") # For debugging
 
             try:
-                # Attempt to parse the string as JSON
-                imu_data = json.loads(user_comment_str)
+                # Attempt to parse the comment as JSON
+                imu_data = orjson.loads(user_comment)
                 return imu_data
-            except json.JSONDecodeError as e_json:
+            except orjson.JSONDecodeError as e_json:
+                if isinstance(user_comment, memoryview):
+                    user_comment = bytes(user_comment).decode('utf-8', errors='replace')
                 print(f"Failed to parse UserComment as JSON: {e_json}")
-                print(f"UserComment content was: {user_comment_str}")
+                print(f"UserComment content was: {user_comment}")
                 return None
         else:
             print("No EXIF UserComment tag found in the image.")
@@ -63,6 +250,30 @@ def read_imu_from_image(image_path):
         print(f"An unexpected error occurred: {e}")
         return None
 
+_BATCH_CHUNKSIZE = 32
+
+def _init_batch_worker():
+    """Warms up the JSON codec once per worker process instead of on its first image."""
+    orjson.loads(orjson.dumps(None))
+
+def read_imu_from_images(image_paths, workers=None):
+    """
+    Reads IMU data from many images, spreading the EXIF parsing over a process pool.
+
+    Args:
+        image_paths (iterable of str): Paths of the image files.
+        workers (int): Number of worker processes (defaults to the CPU count).
+
+    Returns:
+        list: One IMU dict (or None) per path, in the same order as image_paths.
+    """
+    image_paths = list(image_paths)
+    if len(image_paths) <= _BATCH_CHUNKSIZE or workers == 1:
+        # Not worth starting processes; this also keeps the in-process cache warm
+        return [read_imu_from_image(path) for path in image_paths]
+    with concurrent.futures.ProcessPoolExecutor(workers or os.cpu_count(), initializer=_init_batch_worker) as executor:
+        return list(executor.map(read_imu_from_image, image_paths, chunksize=_BATCH_CHUNKSIZE))
+
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("Usage: python read_imu_from_image.py <path_to_image.jpg>")
@@ -1,5 +1,22 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import importlib.util
 import requests
-import json
+import requests.adapters
+import orjson
+import time
+from urllib3.util.retry import Retry
+
+try:
+    import httpx # Optional: only needed for transport="httpx"
+except ImportError:
+    httpx = None
+
+# httpx can only negotiate HTTP/2 when the h2 package is installed
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Request bodies are serialized with orjson and sent as raw bytes, so the type is set once per session
+_JSON_HEADERS = {"Content-Type": "application/json"}
 
 class SnapshotClientError(Exception):
     """Custom exception for SnapshotClient errors."""
@@ -12,47 +29,135 @@ class SnapshotClient:
     """
     A Python client for interacting with the Snapshot Server API.
     """
-    def __init__(self, base_url="http://localhost:88"):
+    __slots__ = (
+        'base_url', 'api_base_url', 'cameras_ttl', '_cameras_cache',
+        '_url_cameras', '_url_all', '_url_stereo', '_snapshot_urls',
+        '_connect_timeout', '_read_timeout', '_timeout',
+        '_session', '_body_arg', '_http_error', '_transport_error',
+    )
+
+    def __init__(self, base_url="http://localhost:88", transport="requests",
+                 connect_timeout=3.05, read_timeout=45, cameras_ttl=30):
         """
         Initializes the client.
         Args:
             base_url (str): The base URL of the Snapshot Server (e.g., "http://localhost:88").
+            transport (str): "requests" (default) or "httpx". httpx keeps connections alive
+                             and negotiates HTTP/2 when the server and the h2 package allow it.
+            connect_timeout (float): Seconds to wait for the TCP connection, so an unreachable
+                                     server fails fast.
+            read_timeout (float): Seconds to wait for a response; a capture can take a while.
+            cameras_ttl (float): Seconds get_cameras() reuses the last camera list before asking
+                                 the server again (0 disables the cache).
         """
         if base_url.endswith('/'):
             base_url = base_url[:-1]
         self.base_url = base_url
         self.api_base_url = f"{self.base_url}/api"
+        # Endpoint URLs are fixed per client, so build them once
+        self._url_cameras = f"{self.api_base_url}/cameras"
+        self._url_all = f"{self.api_base_url}/snapshot/all"
+        self._url_stereo = f"{self.api_base_url}/snapshot/stereo"
+        self._snapshot_urls = {} # camera name -> /api/snapshot/<name> URL, filled lazily
+        self._connect_timeout = connect_timeout
+        self._read_timeout = read_timeout
+        self.cameras_ttl = cameras_ttl
+        self._cameras_cache = None # (time.monotonic() of the fetch, camera list)
+        if transport == "requests":
+            # One pooled session so consecutive calls reuse the same TCP connection.
+            # Status/read retries only cover idempotent methods (urllib3 default), so a snapshot POST
+            # that reached the server is never repeated.
+            self._session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=4, pool_maxsize=8,
+                max_retries=Retry(total=2, backoff_factor=0.1, status_forcelist=[502, 503, 504],
+                                  raise_on_status=False)
+            )
+            self._session.mount("http://", adapter)
+            self._session.mount("https://", adapter)
+            self._session.headers.update(_JSON_HEADERS)
+            self._body_arg = "data"
+            self._timeout = (connect_timeout, read_timeout)
+            self._http_error = requests.exceptions.HTTPError
+            self._transport_error = requests.exceptions.RequestException
+        elif transport == "httpx":
+            if httpx is None:
+                raise ImportError('transport="httpx" requires the httpx package (pip install httpx)')
+            self._timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+            self._session = httpx.Client(
+                http2=_HTTP2_AVAILABLE,
+                limits=httpx.Limits(max_keepalive_connections=8, keepalive_expiry=30),
+                timeout=self._timeout,
+                headers=_JSON_HEADERS
+            )
+            self._body_arg = "content" # httpx takes raw bytes bodies as content=
+            self._http_error = httpx.HTTPStatusError
+            self._transport_error = httpx.RequestError
+        else:
+            raise ValueError(f"Unknown transport: {transport!r}")
+
+    def close(self):
+        """Closes the pooled connections held by the client."""
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def _request(self, method, endpoint, params=None, data=None):
-        """Helper function to make HTTP requests."""
-        url = f"{self.api_base_url}{endpoint}"
+        """Helper function to make HTTP requests to an API endpoint path."""
+        return self._request_url(method, f"{self.api_base_url}{endpoint}", params=params, data=data)
+
+    def _request_url(self, method, url, params=None, data=None):
+        """Makes an HTTP request to a full, already built API URL."""
+        try:
+            body = {self._body_arg: orjson.dumps(data)} if data is not None else {}
+            response = self._session.request(method, url, params=params, timeout=self._timeout, **body)
+        except self._transport_error as e:
+            raise SnapshotClientError(f"Request failed: {e}") from e
+        return self._parse_response(response, self._http_error)
+
+    @staticmethod
+    def _parse_response(response, http_error):
+        """Decodes a JSON API response, turning HTTP errors into SnapshotClientError."""
         try:
-            response = requests.request(method, url, params=params, json=data, timeout=45) # Increased timeout for capture
-            response.raise_for_status()  # Raises HTTPError for bad responses (4XX or 5XX)
-            return response.json()
-        except requests.exceptions.HTTPError as e:
+            response.raise_for_status()  # Raises for bad responses (4XX or 5XX)
+            return orjson.loads(response.content)
+        except orjson.JSONDecodeError as e:
+            raise SnapshotClientError(f"Invalid JSON in response: {e}", status_code=response.status_code, response_text=response.text) from e
+        except http_error as e:
             error_message = f"HTTP error occurred: {e}"
             try:
-                error_details = e.response.json()
+                error_details = orjson.loads(e.response.content)
                 if "error" in error_details:
                     error_message = f"API Error: {error_details['error']}"
                 elif "message" in error_details: # some flask errors might use message
                      error_message = f"API Error: {error_details['message']}"
-            except json.JSONDecodeError:
+            except orjson.JSONDecodeError:
                 pass # Stick with the original HTTP error message
             raise SnapshotClientError(error_message, status_code=e.response.status_code, response_text=e.response.text) from e
-        except requests.exceptions.RequestException as e:
-            raise SnapshotClientError(f"Request failed: {e}") from e
 
     def get_cameras(self):
         """
-        Retrieves the list of configured cameras.
+        Retrieves the list of configured cameras. The list is cached for cameras_ttl
+        seconds; call invalidate_cameras() to force a refresh.
         Returns:
             list: A list of camera configuration dictionaries.
         Raises:
             SnapshotClientError: If the API request fails.
         """
-        return self._request("GET", "/cameras")
+        cached = self._cameras_cache
+        if cached is not None and time.monotonic() - cached[0] < self.cameras_ttl:
+            return list(cached[1])
+        cameras = self._request_url("GET", self._url_cameras)
+        self._cameras_cache = (time.monotonic(), cameras)
+        return list(cameras)
+
+    def invalidate_cameras(self):
+        """Drops the cached camera list so the next get_cameras() asks the server."""
+        self._cameras_cache = None
 
     def snapshot_camera(self, camera_name):
         """
@@ -64,7 +169,14 @@ class SnapshotClient:
         Raises:
             SnapshotClientError: If the API request fails or camera is not found.
         """
-        return self._request("POST", f"/snapshot/{camera_name}")
+        return self._request_url("POST", self._snapshot_url(camera_name))
+
+    def _snapshot_url(self, camera_name):
+        """Returns the snapshot endpoint URL of a camera, building it only on first use."""
+        url = self._snapshot_urls.get(camera_name)
+        if url is None:
+            url = self._snapshot_urls[camera_name] = f"{self.api_base_url}/snapshot/{camera_name}"
+        return url
 
     def snapshot_all_cameras(self):
         """
@@ -74,7 +186,129 @@ class SnapshotClient:
         Raises:
             SnapshotClientError: If the API request fails.
         """
-        return self._request("POST", "/snapshot/all")
+        return self._request_url("POST", self._url_all)
+
+    def snapshot_all_cameras_parallel(self, max_workers=4):
+        """
+        Takes snapshots from all configured cameras by issuing one request per camera
+        in parallel over the pooled session.
+        Args:
+            max_workers (int): Maximum number of concurrent snapshot requests.
+        Returns:
+            dict: {"results": [...]} shaped like the /api/snapshot/all response,
+                  with one entry per camera in configuration order.
+        Raises:
+            SnapshotClientError: If the camera list cannot be retrieved or no cameras are configured.
+        """
+        cameras = self.get_cameras()
+        if not cameras:
+            raise SnapshotClientError("API Error: No cameras configured", status_code=404)
+        return self.snapshot_many([cam['name'] for cam in cameras], max_workers=max_workers)
+
+    def snapshot_many(self, camera_names, max_workers=4):
+        """
+        Takes snapshots from the given cameras, one request per camera in parallel.
+        Args:
+            camera_names (list): Names of the cameras to snapshot.
+            max_workers (int): Maximum number of concurrent snapshot requests.
+        Returns:
+            dict: {"results": [...]} shaped like the /api/snapshot/all response,
+                  with one entry per camera in the order given.
+        """
+        camera_names = list(camera_names)
+        if not camera_names:
+            return {"results": []}
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(camera_names)))) as executor:
+            results = list(executor.map(self._snapshot_result, camera_names))
+        return {"results": results}
+
+    def _snapshot_result(self, camera_name):
+        """Snapshots one camera and returns its entry in the /api/snapshot/all result format."""
+        try:
+            result = self.snapshot_camera(camera_name)
+        except SnapshotClientError as e:
+            return {"camera_name": camera_name, "status": "failure", "error": str(e)}
+        return self._result_entry(camera_name, result)
+
+    @staticmethod
+    def _result_entry(camera_name, result):
+        """Converts a /api/snapshot/<camera_name> response into an /api/snapshot/all result entry."""
+        if not result.get("success"):
+            return {"camera_name": camera_name, "status": "failure", "error": result.get("error")}
+        return {
+            "camera_name": camera_name,
+            "status": "success",
+            "filename": result["filename"],
+            "image_url_path": result["image_url_path"]
+        }
+
+    # --- Async capture + download (requires httpx) ---
+    def _new_async_client(self):
+        if httpx is None:
+            raise ImportError("snapshot_and_fetch requires the httpx package (pip install httpx)")
+        return httpx.AsyncClient(
+            http2=_HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_keepalive_connections=8, keepalive_expiry=30),
+            timeout=httpx.Timeout(self._read_timeout, connect=self._connect_timeout)
+        )
+
+    async def _async_request(self, client, method, url):
+        try:
+            response = await client.request(method, url)
+        except httpx.RequestError as e:
+            raise SnapshotClientError(f"Request failed: {e}") from e
+        return self._parse_response(response, httpx.HTTPStatusError)
+
+    async def _snapshot_and_fetch(self, client, camera_name):
+        result = await self._async_request(client, "POST", self._snapshot_url(camera_name))
+        if result.get("success"):
+            try:
+                response = await client.get(self.get_image_url(result["image_url_path"]))
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                raise SnapshotClientError(f"Image download failed for {result['filename']}: {e}") from e
+            result["image_data"] = response.content
+        return result
+
+    async def snapshot_and_fetch(self, camera_name):
+        """
+        Takes a snapshot from a specific camera and downloads the image on the same connection.
+        Args:
+            camera_name (str): The name of the camera.
+        Returns:
+            dict: The snapshot_camera response, plus "image_data" (JPEG bytes) on success.
+        Raises:
+            SnapshotClientError: If the snapshot or the download fails.
+        """
+        async with self._new_async_client() as client:
+            return await self._snapshot_and_fetch(client, camera_name)
+
+    async def _fetch_entry(self, client, camera_name):
+        try:
+            result = await self._snapshot_and_fetch(client, camera_name)
+        except SnapshotClientError as e:
+            return {"camera_name": camera_name, "status": "failure", "error": str(e)}
+        entry = self._result_entry(camera_name, result)
+        if "image_data" in result:
+            entry["image_data"] = result["image_data"]
+        return entry
+
+    async def snapshot_all_and_fetch(self):
+        """
+        Takes snapshots from all configured cameras and downloads the images; each camera's
+        capture and download overlaps with the others.
+        Returns:
+            dict: {"results": [...]} shaped like the /api/snapshot/all response, with
+                  "image_data" (JPEG bytes) added to each successful entry.
+        Raises:
+            SnapshotClientError: If the camera list cannot be retrieved or no cameras are configured.
+        """
+        async with self._new_async_client() as client:
+            cameras = await self._async_request(client, "GET", self._url_cameras)
+            if not cameras:
+                raise SnapshotClientError("API Error: No cameras configured", status_code=404)
+            results = await asyncio.gather(*(self._fetch_entry(client, cam['name']) for cam in cameras))
+        return {"results": list(results)}
 
     def snapshot_stereo_cameras(self):
         """
@@ -84,7 +318,7 @@ class SnapshotClient:
         Raises:
             SnapshotClientError: If the API request fails.
         """
-        return self._request("POST", "/snapshot/stereo")
+        return self._request_url("POST", self._url_stereo)
 
     def get_image_url(self, image_path):
         """
@@ -102,78 +336,71 @@ if __name__ == "__main__":
     # Example Usage:
     # Replace with your server's IP if not running locally
     # client = SnapshotClient(base_url="http://your_raspberry_pi_ip:88")
-    client = SnapshotClient(base_url="http://10.0.0.254:88")
-
     print("--- Testing Snapshot Client ---")
 
-    try:
-        # 1. Get list of cameras
-        print("\n1. Fetching cameras...")
-        cameras = client.get_cameras()
-        if cameras:
-            print(f"Found {len(cameras)} cameras:")
-            for cam in cameras:
-                print(f"  - {cam['name']} ({cam['device_path']})")
-        else:
-            print("No cameras configured on the server.")
-            # exit() # Exit if no cameras for further tests
-
-        # 2. Snapshot a specific camera (if any cameras are configured)
-        if cameras:
-            first_camera_name = cameras[0]['name']
-            print(f"\n2. Taking snapshot from '{first_camera_name}'...")
-            try:
-                snap_result = client.snapshot_camera(first_camera_name)
-                print(f"Snapshot result for {first_camera_name}: {snap_result}")
-                if snap_result.get("success"):
-                    image_url = client.get_image_url(snap_result['image_url_path'])
-                    print(f"  Image URL: {image_url}")
-            except SnapshotClientError as e:
-                print(f"Error snapshotting {first_camera_name}: {e}")
-        else:
-            print("\n2. Skipping single camera snapshot (no cameras configured).")
+    # One client (and so one pooled connection) for the whole demo
+    with SnapshotClient(base_url="http://10.0.0.254:88") as client:
+        try:
+            # 1. Get list of cameras (fetched once and reused below)
+            print("\n1. Fetching cameras...")
+            cameras = client.get_cameras()
+            camera_names = [cam['name'] for cam in cameras]
+            if cameras:
+                print(f"Found {len(cameras)} cameras:")
+                for cam in cameras:
+                    print(f"  - {cam['name']} ({cam['device_path']})")
+            else:
+                print("No cameras configured on the server.")
 
+            # 2. Snapshot a specific camera (if any cameras are configured)
+            if camera_names:
+                first_camera_name = camera_names[0]
+                print(f"\n2. Taking snapshot from '{first_camera_name}'...")
+                try:
+                    snap_result = client.snapshot_camera(first_camera_name)
+                    print(f"Snapshot result for {first_camera_name}: {snap_result}")
+                    if snap_result.get("success"):
+                        image_url = client.get_image_url(snap_result['image_url_path'])
+                        print(f"  Image URL: {image_url}")
+                except SnapshotClientError as e:
+                    print(f"Error snapshotting {first_camera_name}: {e}")
+            else:
+                print("\n2. Skipping single camera snapshot (no cameras configured).")
 
-        # 3. Snapshot all cameras
-        print("\n3. Taking snapshot from all cameras...")
-        try:
-            all_snaps_result = client.snapshot_all_cameras()
+            # 3. Snapshot all cameras, one parallel request per camera
+            print("\n3. Taking snapshot from all cameras...")
+            all_snaps_result = client.snapshot_many(camera_names)
             print(f"Snapshot all result: {all_snaps_result}")
-            if all_snaps_result.get("results"):
-                for res in all_snaps_result["results"]:
-                    if res.get("status") == "success":
-                         image_url = client.get_image_url(res['image_url_path'])
-                         print(f"  {res['camera_name']}: SUCCESS - {image_url}")
-                    else:
-                         print(f"  {res['camera_name']}: FAILED - {res.get('error')}")
-        except SnapshotClientError as e:
-            print(f"Error snapshotting all cameras: {e}")
+            for res in all_snaps_result["results"]:
+                if res.get("status") == "success":
+                    image_url = client.get_image_url(res['image_url_path'])
+                    print(f"  {res['camera_name']}: SUCCESS - {image_url}")
+                else:
+                    print(f"  {res['camera_name']}: FAILED - {res.get('error')}")
 
-
-        # 4. Snapshot stereo cameras
-        print("\n4. Taking snapshot from stereo cameras...")
-        try:
-            stereo_snaps_result = client.snapshot_stereo_cameras()
-            print(f"Snapshot stereo result: {stereo_snaps_result}")
-            if stereo_snaps_result.get("results"):
-                 for res in stereo_snaps_result["results"]:
-                    if res.get("status") == "success":
-                         image_url = client.get_image_url(res['image_url_path'])
-                         print(f"  {res['camera_name']}: SUCCESS - {image_url}")
-                    else:
-                         print(f"  {res['camera_name']}: FAILED - {res.get('error')}")
-            elif stereo_snaps_result.get("error"): # Handle case where no stereo cameras are configured
-                print(f"Could not take stereo snapshots: {stereo_snaps_result.get('error')}")
+            # 4. Snapshot stereo cameras
+            print("\n4. Taking snapshot from stereo cameras...")
+            try:
+                stereo_snaps_result = client.snapshot_stereo_cameras()
+                print(f"Snapshot stereo result: {stereo_snaps_result}")
+                if stereo_snaps_result.get("results"):
+                    for res in stereo_snaps_result["results"]:
+                        if res.get("status") == "success":
+                            image_url = client.get_image_url(res['image_url_path'])
+                            print(f"  {res['camera_name']}: SUCCESS - {image_url}")
+                        else:
+                            print(f"  {res['camera_name']}: FAILED - {res.get('error')}")
+                elif stereo_snaps_result.get("error"): # Handle case where no stereo cameras are configured
+                    print(f"Could not take stereo snapshots: {stereo_snaps_result.get('error')}")
+            except SnapshotClientError as e:
+                print(f"Error snapshotting stereo cameras: {e}")
 
         except SnapshotClientError as e:
-            print(f"Error snapshotting stereo cameras: {e}")
-
-    except SnapshotClientError as e:
-        print(f"\nAn API client error occurred:")
-        print(f"  Message: {e}")
-        if e.status_code:
-            print(f"  Status Code: {e.status_code}")
-        if e.response_text:
-            print(f"  Response: {e.response_text[:200]}...") # Print first 200 chars
+            print(f"\nAn API client error occurred:")
+            print(f"  Message: {e}")
+            if e.status_code:
+                print(f"  Status Code: {e.status_code}")
+            if e.response_text:
+                print(f"  Response: {e.response_text[:200]}...") # Print first 200 chars
 
     print("\n--- Test complete ---")
@@ -0,0 +1,358 @@
+"""Persistent in-process V4L2 capture using MMAP buffers.
+
+Keeps a /dev/video* device open and streaming so a snapshot only has to
+dequeue a frame instead of spawning v4l2-ctl and renegotiating the format.
+Only MJPEG is supported: each dequeued buffer already is a complete JPEG.
+"""
+import ctypes
+import errno
+import fcntl
+import mmap
+import os
+import select
+import threading
+
+# --- ioctl request encoding (linux/ioctl.h) ---
+_IOC_NRSHIFT = 0
+_IOC_TYPESHIFT = 8
+_IOC_SIZESHIFT = 16
+_IOC_DIRSHIFT = 30
+_IOC_WRITE = 1
+_IOC_READ = 2
+
+def _IOC(direction, ioc_type, nr, size):
+    return (direction << _IOC_DIRSHIFT) | (ord(ioc_type) << _IOC_TYPESHIFT) | \
+        (nr << _IOC_NRSHIFT) | (size << _IOC_SIZESHIFT)
+
+def _IOW(ioc_type, nr, struct_type):
+    return _IOC(_IOC_WRITE, ioc_type, nr, ctypes.sizeof(struct_type))
+
+def _IOWR(ioc_type, nr, struct_type):
+    return _IOC(_IOC_READ | _IOC_WRITE, ioc_type, nr, ctypes.sizeof(struct_type))
+
+# --- V4L2 structures (linux/videodev2.h) ---
+V4L2_BUF_TYPE_VIDEO_CAPTURE = 1
+V4L2_MEMORY_MMAP = 1
+V4L2_FIELD_ANY = 0
+
+def v4l2_fourcc(code):
+    a, b, c, d = (ord(ch) for ch in code)
+    return a | (b << 8) | (c << 16) | (d << 24)
+
+class v4l2_pix_format(ctypes.Structure):
+    _fields_ = [
+        ('width', ctypes.c_uint32),
+        ('height', ctypes.c_uint32),
+        ('pixelformat', ctypes.c_uint32),
+        ('field', ctypes.c_uint32),
+        ('bytesperline', ctypes.c_uint32),
+        ('sizeimage', ctypes.c_uint32),
+        ('colorspace', ctypes.c_uint32),
+        ('priv', ctypes.c_uint32),
+        ('flags', ctypes.c_uint32),
+        ('ycbcr_enc', ctypes.c_uint32),
+        ('quantization', ctypes.c_uint32),
+        ('xfer_func', ctypes.c_uint32),
+    ]
+
+class _v4l2_format_fmt(ctypes.Union):
+    # The kernel union also holds struct v4l2_window (which has pointers),
+    # so it is pointer-aligned; _align reproduces that layout.
+    _fields_ = [
+        ('pix', v4l2_pix_format),
+        ('raw_data', ctypes.c_uint8 * 200),
+        ('_align', ctypes.c_void_p),
+    ]
+
+class v4l2_format(ctypes.Structure):
+    _fields_ = [
+        ('type', ctypes.c_uint32),
+        ('fmt', _v4l2_format_fmt),
+    ]
+
+class v4l2_requestbuffers(ctypes.Structure):
+    _fields_ = [
+        ('count', ctypes.c_uint32),
+        ('type', ctypes.c_uint32),
+        ('memory', ctypes.c_uint32),
+        ('reserved', ctypes.c_uint32 * 2),
+    ]
+
+class timeval(ctypes.Structure):
+    _fields_ = [
+        ('tv_sec', ctypes.c_long),
+        ('tv_usec', ctypes.c_long),
+    ]
+
+class v4l2_timecode(ctypes.Structure):
+    _fields_ = [
+        ('type', ctypes.c_uint32),
+        ('flags', ctypes.c_uint32),
+        ('frames', ctypes.c_uint8),
+        ('seconds', ctypes.c_uint8),
+        ('minutes', ctypes.c_uint8),
+        ('hours', ctypes.c_uint8),
+        ('userbits', ctypes.c_uint8 * 4),
+    ]
+
+class _v4l2_buffer_m(ctypes.Union):
+    _fields_ = [
+        ('offset', ctypes.c_uint32),
+        ('userptr', ctypes.c_ulong),
+        ('planes', ctypes.c_void_p),
+        ('fd', ctypes.c_int32),
+    ]
+
+class v4l2_buffer(ctypes.Structure):
+    _fields_ = [
+        ('index', ctypes.c_uint32),
+        ('type', ctypes.c_uint32),
+        ('bytesused', ctypes.c_uint32),
+        ('flags', ctypes.c_uint32),
+        ('field', ctypes.c_uint32),
+        ('timestamp', timeval),
+        ('timecode', v4l2_timecode),
+        ('sequence', ctypes.c_uint32),
+        ('memory', ctypes.c_uint32),
+        ('m', _v4l2_buffer_m),
+        ('length', ctypes.c_uint32),
+        ('reserved2', ctypes.c_uint32),
+        ('request_fd', ctypes.c_int32),
+    ]
+
+VIDIOC_S_FMT = _IOWR('V', 5, v4l2_format)
+VIDIOC_REQBUFS = _IOWR('V', 8, v4l2_requestbuffers)
+VIDIOC_QUERYBUF = _IOWR('V', 9, v4l2_buffer)
+VIDIOC_QBUF = _IOWR('V', 15, v4l2_buffer)
+VIDIOC_DQBUF = _IOWR('V', 17, v4l2_buffer)
+VIDIOC_STREAMON = _IOW('V', 18, ctypes.c_int)
+VIDIOC_STREAMOFF = _IOW('V', 19, ctypes.c_int)
+
+SUPPORTED_PIXEL_FORMATS = ('MJPG',)
+
+def buffers_owned_elsewhere(fd):
+    """Returns True if another file handle owns the capture buffers of the device open on fd.
+    On a handle that owns nothing, requesting zero MMAP buffers is a no-op unless another
+    handle owns them, in which case the driver answers EBUSY.
+    """
+    req = v4l2_requestbuffers()
+    req.count = 0
+    req.type = V4L2_BUF_TYPE_VIDEO_CAPTURE
+    req.memory = V4L2_MEMORY_MMAP
+    try:
+        fcntl.ioctl(fd, VIDIOC_REQBUFS, req)
+    except OSError as e:
+        if e.errno == errno.EBUSY:
+            return True
+        raise
+    return False
+
+
+class V4L2Capture:
+    """An open, streaming V4L2 device that hands out one MJPEG frame per grab()."""
+
+    def __init__(self, device_path, width, height, pixel_format, buffer_count=4):
+        if pixel_format not in SUPPORTED_PIXEL_FORMATS:
+            raise ValueError(f"Unsupported pixel format for in-process capture: {pixel_format}")
+        self.device_path = device_path
+        self.lock = threading.Lock()
+        self._buffers = []
+        self._streaming = False
+        self.fd = os.open(device_path, os.O_RDWR | os.O_NONBLOCK)
+        try:
+            self._set_format(width, height, pixel_format)
+            self._map_buffers(buffer_count)
+            buf_type = ctypes.c_int(V4L2_BUF_TYPE_VIDEO_CAPTURE)
+            fcntl.ioctl(self.fd, VIDIOC_STREAMON, buf_type)
+            self._streaming = True
+        except Exception:
+            self.close()
+            raise
+
+    def _set_format(self, width, height, pixel_format):
+        fmt = v4l2_format()
+        fmt.type = V4L2_BUF_TYPE_VIDEO_CAPTURE
+        fmt.fmt.pix.width = width
+        fmt.fmt.pix.height = height
+        fmt.fmt.pix.pixelformat = v4l2_fourcc(pixel_format)
+        fmt.fmt.pix.field = V4L2_FIELD_ANY
+        fcntl.ioctl(self.fd, VIDIOC_S_FMT, fmt)
+        if fmt.fmt.pix.pixelformat != v4l2_fourcc(pixel_format):
+            raise OSError(errno.EINVAL, f"{self.device_path} does not support pixel format {pixel_format}")
+
+    def _map_buffers(self, buffer_count):
+        req = v4l2_requestbuffers()
+        req.count = buffer_count
+        req.type = V4L2_BUF_TYPE_VIDEO_CAPTURE
+        req.memory = V4L2_MEMORY_MMAP
+        fcntl.ioctl(self.fd, VIDIOC_REQBUFS, req)
+        if req.count < 1:
+            raise OSError(errno.ENOMEM, f"No capture buffers available on {self.device_path}")
+        for index in range(req.count):
+            buf = self._new_buffer()
+            buf.index = index
+            fcntl.ioctl(self.fd, VIDIOC_QUERYBUF, buf)
+            self._buffers.append(mmap.mmap(self.fd, buf.length, mmap.MAP_SHARED,
+                                           mmap.PROT_READ | mmap.PROT_WRITE, offset=buf.m.offset))
+            fcntl.ioctl(self.fd, VIDIOC_QBUF, buf)
+
+    @staticmethod
+    def _new_buffer():
+        buf = v4l2_buffer()
+        buf.type = V4L2_BUF_TYPE_VIDEO_CAPTURE
+        buf.memory = V4L2_MEMORY_MMAP
+        return buf
+
+    def _dequeue(self):
+        """Dequeues one filled buffer, or returns None if none is ready yet."""
+        buf = self._new_buffer()
+        try:
+            fcntl.ioctl(self.fd, VIDIOC_DQBUF, buf)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return None
+            raise
+        return buf
+
+    def grab(self, timeout=5.0):
+        """Returns the bytes of a frame captured after this call was made."""
+        try:
+            return self._grab(timeout)
+        finally:
+            _schedule_idle_release(self)
+
+    def _grab(self, timeout):
+        with self.lock:
+            if self.fd is None:
+                # Closed by release_capture() while this thread waited for the lock
+                raise OSError(errno.EBADF, f"Capture for {self.device_path} was closed")
+            # Frames already sitting in the queue were captured before the
+            # request; hand them back to the driver so the next one is fresh.
+            while True:
+                stale = self._dequeue()
+                if stale is None:
+                    break
+                fcntl.ioctl(self.fd, VIDIOC_QBUF, stale)
+
+            while True:
+                readable, _, _ = select.select([self.fd], [], [], timeout)
+                if not readable:
+                    raise OSError(errno.ETIMEDOUT, f"Timed out waiting for a frame from {self.device_path}")
+                buf = self._dequeue()
+                if buf is not None:
+                    break
+            try:
+                return self._buffers[buf.index][:buf.bytesused]
+            finally:
+                fcntl.ioctl(self.fd, VIDIOC_QBUF, buf)
+
+    def close(self):
+        if self.fd is None:
+            return
+        if self._streaming:
+            try:
+                fcntl.ioctl(self.fd, VIDIOC_STREAMOFF, ctypes.c_int(V4L2_BUF_TYPE_VIDEO_CAPTURE))
+            except OSError:
+                pass
+            self._streaming = False
+        for buffer in self._buffers:
+            buffer.close()
+        self._buffers = []
+        os.close(self.fd)
+        self.fd = None
+
+
+# Open captures keyed by device path; each entry remembers the format it was opened with.
+_captures = {}
+_captures_lock = threading.Lock()
+# A streaming camera keeps its USB bandwidth reserved, so captures are closed again once
+# they have not been grabbed from for this many seconds
+CAPTURE_IDLE_TIMEOUT = 30.0
+_idle_timers = {}
+
+def _schedule_idle_release(capture):
+    """(Re)starts the idle timer of a cached capture after a grab."""
+    with _captures_lock:
+        entry = _captures.get(capture.device_path)
+        if entry is None or entry[1] is not capture:
+            return # Already released
+        timer = _idle_timers.pop(capture.device_path, None)
+        if timer is not None:
+            timer.cancel()
+        timer = threading.Timer(CAPTURE_IDLE_TIMEOUT, _release_if_idle, args=(capture.device_path, capture))
+        timer.name = f"v4l2-idle-{capture.device_path}"
+        timer.daemon = True
+        _idle_timers[capture.device_path] = timer
+        timer.start()
+
+def _release_if_idle(device_path, capture):
+    with _captures_lock:
+        # Skip if a new grab started (get_capture drops the timer) or a later timer superseded this one
+        if _idle_timers.get(device_path) is not threading.current_thread():
+            return
+        del _idle_timers[device_path]
+    release_capture(device_path, capture)
+
+def _cancel_idle_timer(device_path):
+    """Caller holds _captures_lock."""
+    timer = _idle_timers.pop(device_path, None)
+    if timer is not None:
+        timer.cancel()
+
+def _release_idle_captures():
+    """Closes every cached capture no grab is using right now. Caller holds _captures_lock."""
+    for device_path, (_, capture) in list(_captures.items()):
+        if not capture.lock.acquire(blocking=False):
+            continue # Mid-grab
+        try:
+            capture.close()
+        finally:
+            capture.lock.release()
+        del _captures[device_path]
+        _cancel_idle_timer(device_path)
+
+def get_capture(device_path, width, height, pixel_format):
+    """Returns the cached V4L2Capture for a device, (re)opening it if the format changed."""
+    key = (width, height, pixel_format)
+    with _captures_lock:
+        entry = _captures.get(device_path)
+        if entry is not None:
+            _cancel_idle_timer(device_path) # In use again
+            if entry[0] == key:
+                return entry[1]
+            # Format changed in the config: release the device before renegotiating
+            with entry[1].lock:
+                entry[1].close()
+            del _captures[device_path]
+        try:
+            capture = V4L2Capture(device_path, width, height, pixel_format)
+        except OSError as e:
+            if e.errno != errno.ENOSPC:
+                raise
+            # Not enough USB bandwidth left: stop the other cameras that are only idling, retry once
+            _release_idle_captures()
+            capture = V4L2Capture(device_path, width, height, pixel_format)
+        _captures[device_path] = (key, capture)
+        return capture
+
+def release_capture(device_path, capture=None):
+    """Closes and forgets the cached capture for a device, if any. If capture is given, only
+    that handle is released, so a failing caller cannot close one another thread just reopened."""
+    with _captures_lock:
+        entry = _captures.get(device_path)
+        if entry is None or (capture is not None and entry[1] is not capture):
+            return
+        del _captures[device_path]
+        _cancel_idle_timer(device_path)
+    with entry[1].lock:
+        entry[1].close()
+
+def release_unused(device_paths):
+    """Closes cached captures for devices not in device_paths (e.g. after a config change)."""
+    for device_path in list(_captures):
+        if device_path not in device_paths:
+            release_capture(device_path)
+
+def release_all():
+    for device_path in list(_captures):
+        release_capture(device_path)